@@ -1,9 +1,258 @@
 import sqlite3
 import pickle
+import os
+import time
+import uuid
+import json
 from abc import ABC, abstractmethod
-from typing import Optional
+from enum import Enum
+from typing import Any, NamedTuple, Optional
 from pathlib import Path
-from .common import Code, Payload, PayloadBin
+from .common import Code, Payload, estimate_size
+from .fingerprint import Fingerprinted, fingerprint, stable_fingerprint
+from . import metrics
+
+# number of timings kept for each task code
+TIMING_HISTORY = 100
+# owner of a lease released without a cached result, see CacheProvider.abandon
+_ABANDONED = ""
+# stores of at most so many bytes take about the fixed overhead, see CacheAdmission.record_store
+SMALL_STORE_BYTES = 64 * 1024
+
+
+class Timing(NamedTuple):
+    """
+    a historical execution of a task
+    """
+
+    duration: float  # seconds
+    keys: tuple[str, ...]  # keys of the result
+
+
+class CachePolicy(Enum):
+    OFF = "off"  # neither look up nor store results
+    READ_ONLY = "read_only"  # use cached results, but do not store new ones
+    WRITE_ONLY = "write_only"  # always execute, and store the result
+    NORMAL = "normal"
+
+    @property
+    def readable(self) -> bool:
+        return self in (CachePolicy.READ_ONLY, CachePolicy.NORMAL)
+
+    @property
+    def writable(self) -> bool:
+        return self in (CachePolicy.WRITE_ONLY, CachePolicy.NORMAL)
+
+
+class CacheAdmission:
+    """
+    CacheAdmission decides whether a result pays off to be cached: it is admitted when it is small,
+    or when the task runs cost_factor times longer than serializing and storing the result.
+    the size of a result is estimated without serializing it, the store cost is measured
+    as a fixed overhead plus a cost per byte
+    """
+
+    def __init__(self, cost_factor: float = 2.0, size_limit: int = 1024):
+        """
+        :param cost_factor: how many times the duration must exceed the cost of caching
+        :param size_limit: results estimated at most size_limit bytes are always admitted
+        """
+        self.cost_factor = cost_factor
+        self.size_limit = size_limit
+        # moving averages of the measured store cost, a prior of about 500 MB/s until measured
+        self.store_overhead_seconds = 0.0
+        self.store_seconds_per_byte = 2e-9
+        self.overhead_measured = False
+        self.per_byte_measured = False
+
+    def estimate(self, result: Payload) -> tuple[int, float]:
+        """
+        get the estimated size and the estimated seconds of caching result
+
+        :param result: the result of the task
+        """
+        size = estimate_size(result)
+        return size, self.store_overhead_seconds + size * self.store_seconds_per_byte
+
+    def admit(self, duration: float, size: int, cost: float) -> bool:
+        """
+        whether to cache a result
+
+        :param duration: seconds the task took
+        :param size: estimated size of the result, see estimate
+        :param cost: estimated seconds of caching the result, see estimate
+        """
+        return size <= self.size_limit or duration >= self.cost_factor * cost
+
+    def record_store(self, size: int, seconds: float):
+        """
+        record a measured store of a result, small stores measure the fixed overhead,
+        larger ones the cost per byte beyond it
+
+        :param size: estimated size of the result, see estimate
+        :param seconds: seconds the store took
+        """
+        if size <= SMALL_STORE_BYTES:
+            overhead = max(seconds - size * self.store_seconds_per_byte, 0.0)
+            self.store_overhead_seconds = _moving_average(
+                self.store_overhead_seconds, overhead, self.overhead_measured
+            )
+            self.overhead_measured = True
+        else:
+            per_byte = max(seconds - self.store_overhead_seconds, 0.0) / size
+            self.store_seconds_per_byte = _moving_average(
+                self.store_seconds_per_byte, per_byte, self.per_byte_measured
+            )
+            self.per_byte_measured = True
+
+
+def _moving_average(average: float, value: float, measured: bool) -> float:
+    """
+    update a moving average with a measured value, the first measure replaces the prior
+    """
+    return 0.8 * average + 0.2 * value if measured else value
+
+
+class LazyValue(Fingerprinted):
+    """
+    a cached value deserialized on first access, its fingerprint is known without loading it
+    """
+
+    def __init__(self, digest: Optional[str], data: bytes):
+        """
+        :param digest: the stored fingerprint of the value, None to compute it from the value,
+            e.g. it holds paths, see stable_fingerprint
+        :param data: the serialized value, read at the cache hit
+        """
+        self.stable = digest is not None
+        self._value_digest = digest
+        self._data: Optional[bytes] = data
+        self._value: Any = None
+
+    @property
+    def digest(self) -> str:
+        if self._value_digest is None:
+            self._value_digest = fingerprint(self.get())
+        return self._value_digest
+
+    def get(self) -> Any:
+        """
+        get the value, deserialized on the first call
+        """
+        if self._data is not None:
+            self._value = pickle.loads(self._data)
+            self._data = None
+        return self._value
+
+    def dumps(self) -> bytes:
+        """
+        get the serialized value, without deserializing it if not loaded yet
+        """
+        if self._data is not None:
+            return self._data
+        return pickle.dumps(self._value)
+
+    def __eq__(self, other):
+        if isinstance(other, LazyValue):
+            other = other.get()
+        return self.get() == other
+
+    __hash__ = None  # type: ignore
+
+    def __repr__(self):
+        return (
+            "LazyValue(...)"
+            if self._data is not None
+            else f"LazyValue({self._value!r})"
+        )
+
+
+def resolve(payload: Payload) -> Payload:
+    """
+    get a copy of payload with lazy values deserialized
+
+    :param payload: the payload, e.g. params of a task
+    """
+    return {
+        key: value.get() if isinstance(value, LazyValue) else value
+        for key, value in payload.items()
+    }
+
+
+class LazyPayload(dict):
+    """
+    payload deserializing its lazy values on first access
+    """
+
+    @staticmethod
+    def wrap(payload: Payload) -> Payload:
+        """
+        get payload as a LazyPayload if it holds lazy values, otherwise itself
+
+        :param payload: the payload
+        """
+        if any(isinstance(value, LazyValue) for value in dict.values(payload)):
+            return LazyPayload(dict.items(payload))
+        return payload
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        if isinstance(value, LazyValue):
+            value = value.get()
+            super().__setitem__(key, value)
+        return value
+
+    def __iter__(self):
+        # defined so dict(payload) and **payload go through __getitem__
+        return super().__iter__()
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def items(self):  # type: ignore[override]
+        return [(key, self[key]) for key in self]
+
+    def values(self):  # type: ignore[override]
+        return [self[key] for key in self]
+
+    def pop(self, key, *default):
+        if key in self:
+            value = self[key]
+            super().pop(key)
+            return value
+        return super().pop(key, *default)
+
+    def popitem(self):
+        key, value = super().popitem()
+        if isinstance(value, LazyValue):
+            value = value.get()
+        return key, value
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return self[key]
+        self[key] = default
+        return default
+
+    def copy(self) -> "LazyPayload":
+        """
+        shallow copy, lazy values stay lazy
+        """
+        return LazyPayload(dict.items(self))
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+def _record_lookup(provider: "CacheProvider", result: Optional[Payload], start: float):
+    """
+    record a cache lookup started at start (time.perf_counter) in metrics
+    """
+    if not metrics.REGISTRY.enabled:
+        return
+    name = provider.__class__.__name__
+    metrics.CACHE_LOOKUPS.inc(provider=name, result="miss" if result is None else "hit")
+    metrics.CACHE_LOOKUP_SECONDS.observe(time.perf_counter() - start, provider=name)
 
 
 class CacheProvider(ABC):
@@ -11,6 +260,11 @@ class CacheProvider(ABC):
     Abstract class for cache provider
     '''
 
+    # whether worker processes can use a copy of the provider, e.g. the same db file
+    process_safe = False
+    # seconds after which a lease not renewed is considered abandoned
+    lease_timeout: float = 60.0
+
     @abstractmethod
     def get(self, code: Code, params: Payload) -> Optional[Payload]:
         """
@@ -21,6 +275,22 @@ class CacheProvider(ABC):
         """
         raise NotImplementedError
 
+    def get_digests(
+        self, code: Code, params: Payload
+    ) -> Optional[dict[str, Optional[str]]]:
+        """
+        get the fingerprints of the values of the result for code and params, return None if not found.
+        a fingerprint is None if it is computed from the value when read, e.g. it holds paths.
+        unlike get, it records no lookup, the default implementation reads the result by get
+
+        :param code: the code of the task
+        :param params: the params of the task
+        """
+        result = self.get(code, params)
+        if result is None:
+            return None
+        return {key: fingerprint(value) for key, value in dict.items(result)}
+
     @abstractmethod
     def set(self, code: Code, params: Payload, result: Payload):
         """
@@ -41,6 +311,58 @@ class CacheProvider(ABC):
         """
         raise NotImplementedError
 
+    def acquire(self, code: Code, params: Payload) -> bool:
+        """
+        try to acquire the lease for computing code with params, return False if another process holds it.
+        the default implementation always succeeds, providers shared between processes should override it
+
+        :param code: the code of the task
+        :param params: the params of the task
+        """
+        return True
+
+    def renew(self, code: Code, params: Payload):
+        """
+        extend the lease acquired by acquire for another lease_timeout, called periodically while the task runs
+
+        :param code: the code of the task
+        :param params: the params of the task
+        """
+
+    def release(self, code: Code, params: Payload):
+        """
+        release the lease acquired by acquire
+
+        :param code: the code of the task
+        :param params: the params of the task
+        """
+
+    def abandon(self, code: Code, params: Payload):
+        """
+        release the lease acquired by acquire without caching a result, e.g. it is not admitted.
+        processes waiting for the lease compute the task at once instead of one after another
+
+        :param code: the code of the task
+        :param params: the params of the task
+        """
+        self.release(code, params)
+
+    def add_timing(self, code: Code, timing: Timing):
+        """
+        record an execution of code, the default implementation discards it
+
+        :param code: the code of the task
+        :param timing: the execution
+        """
+
+    def get_timings(self, code: Code) -> list[Timing]:
+        """
+        get recent executions of code, the latest last
+
+        :param code: the code of the task
+        """
+        return []
+
     def _check_valid(self) -> bool:
         """
         check if the cache provider is valid
@@ -70,15 +392,28 @@ class MemoryCacheProvider(CacheProvider):
     """
 
     def __init__(self: "MemoryCacheProvider"):
-        self.d: dict[tuple[Code, PayloadBin], Payload] = {}
+        self.d: dict[tuple[Code, str], Payload] = {}
+        self.timings: dict[Code, list[Timing]] = {}
 
     def get(self, code: Code, params: Payload) -> Optional[Payload]:
-        params_bin = pickle.dumps(params)
-        return self.d.get((code, params_bin))
+        start = time.perf_counter()
+        params_fp = fingerprint(params)
+        result = self.d.get((code, params_fp))
+        _record_lookup(self, result, start)
+        return result
+
+    def get_digests(
+        self, code: Code, params: Payload
+    ) -> Optional[dict[str, Optional[str]]]:
+        result = self.d.get((code, fingerprint(params)))
+        if result is None:
+            return None
+        return {key: fingerprint(value) for key, value in dict.items(result)}
 
     def set(self, code: Code, params: Payload, result: Payload):
-        params_bin = pickle.dumps(params)
-        self.d[(code, params_bin)] = result
+        params_fp = fingerprint(params)
+        self.d[(code, params_fp)] = result
+        metrics.CACHE_WRITES.inc(provider=self.__class__.__name__)
         # logger.debug(f"set cache for code: {code}, params: {params}, result: {result}")
         # logger.debug(f"cache: {self.d}")
 
@@ -89,7 +424,17 @@ class MemoryCacheProvider(CacheProvider):
         if remain_records == 0:
             self.d.clear()
         else:
+            evicted = max(len(self.d) - remain_records, 0)
             self.d = dict(list(self.d.items())[-remain_records:])
+            metrics.CACHE_EVICTIONS.inc(evicted, provider=self.__class__.__name__)
+
+    def add_timing(self, code: Code, timing: Timing):
+        timings = self.timings.setdefault(code, [])
+        timings.append(timing)
+        del timings[:-TIMING_HISTORY]
+
+    def get_timings(self, code: Code) -> list[Timing]:
+        return list(self.timings.get(code, []))
 
 
 class SqliteCacheProvider(CacheProvider):
@@ -97,13 +442,18 @@ class SqliteCacheProvider(CacheProvider):
     SqliteCacheProvider is a sqlite cache provider
     """
 
-    def __init__(self, db_path: Optional[Path] = None):
+    process_safe = True
+
+    def __init__(self, db_path: Optional[Path] = None, lease_timeout: float = 60.0):
         """
         :param db_path: the path of the sqlite db file
+        :param lease_timeout: seconds after which a lease not renewed, e.g. of a crashed process, expires
         """
         if db_path is None:
             db_path = Path("cache.db")
         self.db_path = db_path
+        self.lease_timeout = lease_timeout
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex}"
 
     def _create_db(self):
         """
@@ -120,40 +470,272 @@ class SqliteCacheProvider(CacheProvider):
             )
             conn.commit()
 
+    def _create_lease_table(self, c: sqlite3.Cursor):
+        """
+        _create_lease_table create the lease table if not exists, db files of older versions lack it
+        """
+        c.execute(
+            "CREATE TABLE IF NOT EXISTS lease (code TEXT, params TEXT, owner TEXT, expires_at REAL, UNIQUE(code, params))"
+        )
+
+    def _create_timing_table(self, c: sqlite3.Cursor):
+        """
+        _create_timing_table create the timing table if not exists, db files of older versions lack it
+        """
+        c.execute(
+            "CREATE TABLE IF NOT EXISTS timing (code TEXT, duration REAL, keys TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+        )
+
+    def _create_value_table(self, c: sqlite3.Cursor):
+        """
+        _create_value_table create the table of result values if not exists, db files of older versions lack it
+        """
+        c.execute(
+            "CREATE TABLE IF NOT EXISTS cache_value (code TEXT, params TEXT, key TEXT, value BLOB, UNIQUE(code, params, key))"
+        )
+
     def get(self, code: str, params: Payload) -> Optional[Payload]:
+        start = time.perf_counter()
         self._create_db()
 
-        params_bin = pickle.dumps(params)
+        params_fp = fingerprint(params)
 
+        values: dict[str, bytes] = {}
         with sqlite3.connect(self.db_path) as conn:
             c = conn.cursor()
+            # the index and the values are read in one transaction, so a concurrent set
+            # never mixes them, only deserializing is deferred
+            c.execute("BEGIN")
             c.execute(
                 "SELECT result FROM cache WHERE code = ? AND params = ?",
-                (code, params_bin),
+                (code, params_fp),
             )
             record = c.fetchone()
             # logger.debug(f"record: {record}")
-            if record is None:
+            if record is not None and not isinstance(record[0], bytes):
+                c.execute(
+                    "SELECT key, value FROM cache_value WHERE code = ? AND params = ?",
+                    (code, params_fp),
+                )
+                values = dict(c.fetchall())
+            conn.commit()
+
+        if record is None:
+            _record_lookup(self, None, start)
+            return None
+
+        read_bytes = len(record[0])
+        if isinstance(record[0], bytes):
+            # a whole pickled result, written by older versions
+            result = pickle.loads(record[0])
+        else:
+            # key -> fingerprint of the value, values are stored in cache_value
+            digests: dict[str, Optional[str]] = json.loads(record[0])
+            if not digests.keys() <= values.keys():
+                # an incomplete record is a miss
+                _record_lookup(self, None, start)
                 return None
+            result = {
+                key: LazyValue(digest, values[key]) for key, digest in digests.items()
+            }
+            read_bytes += sum(len(values[key]) for key in digests)
+        _record_lookup(self, result, start)
+        metrics.CACHE_READ_BYTES.inc(read_bytes, provider=self.__class__.__name__)
+        return result
+
+    def get_digests(
+        self, code: Code, params: Payload
+    ) -> Optional[dict[str, Optional[str]]]:
+        self._create_db()
+
+        params_fp = fingerprint(params)
+
+        keys: set[str] = set()
+        with sqlite3.connect(self.db_path) as conn:
+            c = conn.cursor()
+            c.execute("BEGIN")
+            c.execute(
+                "SELECT result FROM cache WHERE code = ? AND params = ?",
+                (code, params_fp),
+            )
+            record = c.fetchone()
+            if record is not None and not isinstance(record[0], bytes):
+                # only the keys of the values, they are not read
+                c.execute(
+                    "SELECT key FROM cache_value WHERE code = ? AND params = ?",
+                    (code, params_fp),
+                )
+                keys = {key for (key,) in c.fetchall()}
+            conn.commit()
+
+        if record is None:
+            return None
+        if isinstance(record[0], bytes):
+            # a whole pickled result, written by older versions
             result = pickle.loads(record[0])
-            return result
+            return {key: fingerprint(value) for key, value in result.items()}
+        digests: dict[str, Optional[str]] = json.loads(record[0])
+        if not digests.keys() <= keys:
+            # an incomplete record is a miss
+            return None
+        return digests
 
     def set(self, code: str, params: Payload, result: Payload):
         # logger.debug(f"set cache for code: {code}, params: {params}, result: {result}")
         self._create_db()
 
-        params_bin = pickle.dumps(params)
-        result_bin = pickle.dumps(result)
+        params_fp = fingerprint(params)
+        # each value is stored separately, so a hit deserializes only the values read
+        values: list[tuple[str, bytes]] = []
+        digests: dict[str, Optional[str]] = {}
+        for key, value in dict.items(result):
+            if isinstance(value, LazyValue):
+                values.append((key, value.dumps()))
+                digests[key] = value.digest if value.stable else None
+            else:
+                values.append((key, pickle.dumps(value)))
+                # the fingerprint of a path changes with the file, compute it when read
+                digests[key] = stable_fingerprint(value)
+        index = json.dumps(digests)
 
         with sqlite3.connect(self.db_path) as conn:
             c = conn.cursor()
+            self._create_value_table(c)
             c.execute(
                 "INSERT OR REPLACE INTO cache (code, params, result) VALUES (?, ?, ?)",
-                (code, params_bin, result_bin),
+                (code, params_fp, index),
+            )
+            c.execute(
+                "DELETE FROM cache_value WHERE code = ? AND params = ?",
+                (code, params_fp),
+            )
+            c.executemany(
+                "INSERT INTO cache_value (code, params, key, value) VALUES (?, ?, ?, ?)",
+                [(code, params_fp, key, value) for key, value in values],
+            )
+
+            conn.commit()
+
+        metrics.CACHE_WRITES.inc(provider=self.__class__.__name__)
+        metrics.CACHE_WRITTEN_BYTES.inc(
+            len(index) + sum(len(value) for _, value in values),
+            provider=self.__class__.__name__,
+        )
+
+    def acquire(self, code: Code, params: Payload) -> bool:
+        self._create_db()
+
+        params_fp = fingerprint(params)
+        now = time.time()
+
+        with sqlite3.connect(self.db_path) as conn:
+            c = conn.cursor()
+            self._create_lease_table(c)
+            # drop the lease of a crashed process
+            c.execute(
+                "DELETE FROM lease WHERE code = ? AND params = ? AND expires_at < ?",
+                (code, params_fp, now),
             )
+            c.execute(
+                "INSERT OR IGNORE INTO lease (code, params, owner, expires_at) VALUES (?, ?, ?, ?)",
+                (code, params_fp, self.owner, now + self.lease_timeout),
+            )
+            acquired = c.rowcount == 1
+            if not acquired:
+                # an abandoned lease lets every process compute the task
+                c.execute(
+                    "SELECT owner FROM lease WHERE code = ? AND params = ?",
+                    (code, params_fp),
+                )
+                record = c.fetchone()
+                acquired = record is not None and record[0] == _ABANDONED
+            conn.commit()
+            return acquired
+
+    def renew(self, code: Code, params: Payload):
+        if not self.db_path.exists():
+            return
+
+        params_fp = fingerprint(params)
+
+        with sqlite3.connect(self.db_path) as conn:
+            c = conn.cursor()
+            self._create_lease_table(c)
+            c.execute(
+                "UPDATE lease SET expires_at = ? WHERE code = ? AND params = ? AND owner = ?",
+                (time.time() + self.lease_timeout, code, params_fp, self.owner),
+            )
+            conn.commit()
 
+    def release(self, code: Code, params: Payload):
+        if not self.db_path.exists():
+            return
+
+        params_fp = fingerprint(params)
+
+        with sqlite3.connect(self.db_path) as conn:
+            c = conn.cursor()
+            self._create_lease_table(c)
+            c.execute(
+                "DELETE FROM lease WHERE code = ? AND params = ? AND owner = ?",
+                (code, params_fp, self.owner),
+            )
             conn.commit()
 
+    def abandon(self, code: Code, params: Payload):
+        if not self.db_path.exists():
+            return
+
+        params_fp = fingerprint(params)
+
+        with sqlite3.connect(self.db_path) as conn:
+            c = conn.cursor()
+            self._create_lease_table(c)
+            # kept until it expires, then a later result may be admitted again
+            c.execute(
+                "UPDATE lease SET owner = ?, expires_at = ? WHERE code = ? AND params = ? AND owner = ?",
+                (
+                    _ABANDONED,
+                    time.time() + self.lease_timeout,
+                    code,
+                    params_fp,
+                    self.owner,
+                ),
+            )
+            conn.commit()
+
+    def add_timing(self, code: Code, timing: Timing):
+        self._create_db()
+
+        with sqlite3.connect(self.db_path) as conn:
+            c = conn.cursor()
+            self._create_timing_table(c)
+            c.execute(
+                "INSERT INTO timing (code, duration, keys) VALUES (?, ?, ?)",
+                (code, timing.duration, json.dumps(timing.keys)),
+            )
+            c.execute(
+                "DELETE FROM timing WHERE code = ? AND ROWID NOT IN (SELECT ROWID FROM timing WHERE code = ? ORDER BY ROWID DESC LIMIT ?)",
+                (code, code, TIMING_HISTORY),
+            )
+            conn.commit()
+
+    def get_timings(self, code: Code) -> list[Timing]:
+        if not self.db_path.exists():
+            return []
+
+        with sqlite3.connect(self.db_path) as conn:
+            c = conn.cursor()
+            self._create_timing_table(c)
+            c.execute(
+                "SELECT duration, keys FROM timing WHERE code = ? ORDER BY ROWID",
+                (code,),
+            )
+            return [
+                Timing(duration, tuple(json.loads(keys)))
+                for duration, keys in c.fetchall()
+            ]
+
     def clear(self, remain_records: int = 0):
         if remain_records < 0:
             raise ValueError("remain_records must be greater than or equal to 0")
@@ -171,4 +753,11 @@ class SqliteCacheProvider(CacheProvider):
                 "DELETE FROM cache WHERE ROWID NOT IN (SELECT ROWID FROM cache ORDER BY created_at DESC LIMIT ?)",
                 (remain_records,),
             )
+            evicted = c.rowcount
+            self._create_value_table(c)
+            c.execute(
+                "DELETE FROM cache_value WHERE NOT EXISTS (SELECT 1 FROM cache WHERE cache.code = cache_value.code AND cache.params = cache_value.params)"
+            )
             conn.commit()
+
+        metrics.CACHE_EVICTIONS.inc(evicted, provider=self.__class__.__name__)
@@ -1,5 +1,42 @@
+import sys
 from typing import Any
 
 Code = str
 Payload = dict[str, Any]
 PayloadBin = bytes
+
+
+def estimate_size(value: Any) -> int:
+    """
+    estimate the size of value in bytes without serializing it,
+    buffers and strings count their length, containers and object attributes are followed
+
+    :param value: the value to estimate
+    """
+    size = 0
+    seen: set[int] = set()
+    stack = [value]
+    while stack:
+        v = stack.pop()
+        if id(v) in seen:
+            continue
+        seen.add(id(v))
+
+        if isinstance(v, str):
+            size += len(v)
+            continue
+        try:
+            size += memoryview(v).nbytes
+            continue
+        except TypeError:
+            pass
+
+        size += sys.getsizeof(v)
+        if isinstance(v, dict):
+            stack.extend(v.keys())
+            stack.extend(v.values())
+        elif isinstance(v, (list, tuple, set, frozenset)):
+            stack.extend(v)
+        elif hasattr(v, "__dict__") and not isinstance(v, type):
+            stack.append(vars(v))
+    return size
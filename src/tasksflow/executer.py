@@ -1,14 +1,80 @@
-from .common import Payload
+from .common import Code, Payload
 
 from .task import Task
-from .cache import CacheProvider
+from .cache import (
+    CacheAdmission,
+    CachePolicy,
+    CacheProvider,
+    LazyPayload,
+    Timing,
+    resolve,
+)
+from .fingerprint import FingerprintedDict, fingerprint
+from . import metrics
+from . import store
 from loguru import logger
+import bisect
+import collections
 import concurrent.futures
+import copy
+import functools
+import threading
 from enum import Enum
-from typing import Optional
+from typing import Iterator, Optional
 import multiprocessing
 from abc import ABC, abstractmethod
 import inspect
+import os
+import statistics
+import time
+
+TaskKey = tuple[Code, str]  # (task code, params fingerprint)
+
+
+class FailureMode(Enum):
+    FAIL_FAST = "fail_fast"  # stop all work on the first failed task
+    KEEP_GOING = "keep_going"  # finish all branches independent of failed tasks
+
+
+class ExecutionError(Exception):
+    """
+    raised when tasks fail, holds the partial results of the run
+    """
+
+    def __init__(
+        self,
+        errors: list[tuple[int, Task, BaseException]],
+        payloads: list[Payload],
+        completed: list[list[Task]],
+    ):
+        """
+        :param errors: (instance index, task, exception) of the failed tasks
+        :param payloads: partial payload of each instance, run has a single instance,
+            empty for the instances already yielded by run_many
+        :param completed: completed tasks of each instance
+        """
+        names = ", ".join(
+            f"{task.__class__.__name__}: {exc!r}" for _, task, exc in errors
+        )
+        super().__init__(f"{len(errors)} task(s) failed, {names}")
+        self.errors = errors
+        self.payloads = [LazyPayload.wrap(payload) for payload in payloads]
+        self.completed = completed
+
+    @property
+    def payload(self) -> Payload:
+        """
+        partial payload of the instance of the first failed task
+        """
+        return self.payloads[self.errors[0][0]]
+
+
+def _take(payloads: list[Payload], i: int) -> Payload:
+    """
+    get payloads[i] and replace it with an empty payload
+    """
+    payload, payloads[i] = payloads[i], {}
+    return payload
 
 
 def _get_task_params_names(task: Task) -> list[str]:
@@ -23,201 +89,1301 @@ def _get_task_params_names(task: Task) -> list[str]:
     return names
 
 
+def _get_task_params(task: Task, d_payload: Payload) -> FingerprintedDict:
+    """
+    get the params of the task from d_payload, fingerprinted once for all cache provider calls
+
+    :param task: the task
+    :param d_payload: param -> value, must hold all the params of the task
+    """
+    return FingerprintedDict(
+        {param: d_payload[param] for param in _get_task_params_names(task)}
+    )
+
+
+# attributes of Task telling executers how to run it, they do not change its result
+_TASK_OPTIONS = frozenset(
+    {"enable_cache", "cache_provider", "resources", "cache_policy", "idempotent"}
+)
+
+
+@functools.cache
+def _get_class_source(cls: type) -> str:
+    return inspect.getsource(cls)
+
+
+def _get_task_code(task: Task) -> Code:
+    """
+    get the code identifying what the task computes: the source of its class,
+    and the fingerprint of its own state if it has any, e.g. set by its __init__
+
+    :param task: the task
+    """
+    source = _get_class_source(task.__class__)
+    config = {
+        name: value for name, value in vars(task).items() if name not in _TASK_OPTIONS
+    }
+    if not config:
+        return source
+    return f"{source}\n# config: {fingerprint(config)}"
+
+
+def _execute_task(task: Task, task_params: Payload) -> tuple[Payload, float]:
+    """
+    execute the task, return the result and the duration in seconds
+
+    :param task: the task
+    :param task_params: the params of the task
+    """
+    start = time.perf_counter()
+    result = task._execute(**task_params)
+    return result, time.perf_counter() - start
+
+
+# the executer of this worker process, set by _init_store_worker
+_worker_executer: Optional["Executer"] = None
+
+
+def _init_store_worker(executer: "Executer", metrics_enabled: bool):
+    global _worker_executer
+    _worker_executer = executer
+    # recorded values are drained after each task and merged into the registry of the parent
+    metrics.REGISTRY.enabled = metrics_enabled
+
+
+def _execute_task_in_store(
+    task: Task, task_params: Payload, task_key: TaskKey, keep: bool
+) -> tuple[Payload, float, Optional[bool], dict[str, dict]]:
+    """
+    execute the task in a worker of the object store, params may refer to values kept in the worker.
+    return the result, the duration in seconds, whether the worker cached the result
+    (None if the worker left caching to the parent), and the metrics recorded by the worker
+
+    :param task: the task
+    :param task_params: the params of the task
+    :param task_key: the key of the invocation, see Executer._get_task_key
+    :param keep: keep the result in the worker and return references to it,
+        the worker caches it if its executer has a cache provider
+    """
+    params = FingerprintedDict(
+        {
+            name: store.get(value) if isinstance(value, store.Ref) else value
+            for name, value in task_params.items()
+        },
+        task_key[1],
+    )
+    result, duration = _execute_task(task, params)
+    if not keep:
+        return result, duration, None, metrics.REGISTRY.drain()
+
+    cached = False
+    if _worker_executer is not None:
+        cached = _worker_executer._set_task_result_to_cache(
+            task, params, task_key, result, duration
+        )
+    refs: Payload = {key: store.put(value) for key, value in result.items()}
+    return refs, duration, cached, metrics.REGISTRY.drain()
+
+
 class Executer(ABC):
     """
     Abstract class for task execution
     """
 
-    def __init__(self, cache_provider: Optional[CacheProvider] = None):
+    def __init__(
+        self,
+        cache_provider: Optional[CacheProvider] = None,
+        lease_poll_interval: float = 1.0,
+        failure_mode: FailureMode = FailureMode.FAIL_FAST,
+        cache_admission: Optional[CacheAdmission] = None,
+    ):
+        """
+        :param cache_provider: cache task execution result to avoid re-execution for the same input
+        :param lease_poll_interval: seconds between cache lookups while another process computes the same task
+        :param failure_mode: stop on the first failed task, or finish the independent branches,
+            either way ExecutionError is raised with the partial results
+        :param cache_admission: cache only the results that pay off, default to cache all results
+        """
         self.cache_provider = cache_provider
+        self.lease_poll_interval = lease_poll_interval
+        self.failure_mode = failure_mode
+        self.cache_admission = cache_admission
+
+    def _get_task_key(self, task: Task, task_params: Payload) -> TaskKey:
+        """
+        get the key identifying an invocation of task with task_params
+
+        :param task: the task
+        :param task_params: the params of the task, see _get_task_params
+        """
+        return (_get_task_code(task), fingerprint(task_params))
 
     def _get_task_result_from_cache(
-        self, task: Task, task_params: Payload
+        self, task: Task, task_params: Payload, task_key: TaskKey
     ) -> Optional[Payload]:
         """
         get task result from cache, return None if not found
 
         :param task: the task
         :param task_params: the params of the task
+        :param task_key: the key of the invocation, see _get_task_key
         """
-        if self.cache_provider is None:
+        if self.cache_provider is None or not task.cache_policy.readable:
             return None
 
-        task_code = inspect.getsource(task.__class__)
-        cache_output = self.cache_provider.get(task_code, task_params)
+        cache_output = self.cache_provider.get(task_key[0], task_params)
         return cache_output
 
     def _set_task_result_to_cache(
-        self, task: Task, task_params: Payload, result: Payload
-    ):
+        self,
+        task: Task,
+        task_params: Payload,
+        task_key: TaskKey,
+        result: Payload,
+        duration: Optional[float] = None,
+    ) -> bool:
         """
-        set task result to cache
+        set task result to cache, return whether the result is stored
 
         :param task: the task
         :param task_params: the params of the task
+        :param task_key: the key of the invocation, see _get_task_key
+        :param result: the result of the task
+        :param duration: seconds the task took, used by cache_admission
+        """
+        if self.cache_provider is None or not task.cache_policy.writable:
+            return False
+
+        size = 0
+        if self.cache_admission is not None and duration is not None:
+            size, cost = self.cache_admission.estimate(result)
+            if not self.cache_admission.admit(duration, size, cost):
+                logger.debug(
+                    f"cache not admitted task: {task.__class__.__name__}, duration {duration:.4f}s, cost {cost:.4f}s"
+                )
+                return False
+
+        start = time.perf_counter()
+        self.cache_provider.set(task_key[0], task_params, result)
+        if self.cache_admission is not None:
+            self.cache_admission.record_store(size, time.perf_counter() - start)
+        return True
+
+    def _add_task_timing(
+        self, task: Task, task_key: TaskKey, duration: float, result: Payload
+    ):
+        """
+        record the duration of an execution of the task
+
+        :param task: the task
+        :param task_key: the key of the invocation, see _get_task_key
+        :param duration: the duration in seconds
         :param result: the result of the task
         """
+        task_name = task.__class__.__name__
+        metrics.TASKS_EXECUTED.inc(task=task_name)
+        metrics.TASK_DURATION_SECONDS.observe(duration, task=task_name)
+
         if self.cache_provider is not None:
-            task_code = inspect.getsource(task.__class__)
-            self.cache_provider.set(task_code, task_params, result)
+            self.cache_provider.add_timing(
+                task_key[0], Timing(duration, tuple(result.keys()))
+            )
+
+    def _get_task_result_or_lease(
+        self, task: Task, task_params: Payload, task_key: TaskKey
+    ) -> tuple[Optional[Payload], bool]:
+        """
+        get task result from cache, or acquire the lease to compute it.
+        return (result, False) on cache hit, (None, True) if the lease is acquired,
+        and (None, False) if another process is computing the task
+
+        :param task: the task
+        :param task_params: the params of the task
+        :param task_key: the key of the invocation, see _get_task_key
+        """
+        result = self._get_task_result_from_cache(task, task_params, task_key)
+        if result is not None:
+            return result, False
+        if self.cache_provider is None or task.cache_policy != CachePolicy.NORMAL:
+            # waiting for a result is useless if it is not read or not stored
+            return None, True
+
+        if not self.cache_provider.acquire(task_key[0], task_params):
+            return None, False
+
+        # the result may be set between the lookup and the acquire
+        result = self._get_task_result_from_cache(task, task_params, task_key)
+        if result is not None:
+            self.cache_provider.release(task_key[0], task_params)
+            return result, False
+        return None, True
+
+    def _holds_task_lease(self, task: Task) -> bool:
+        """
+        whether _get_task_result_or_lease acquires a lease in the cache provider for the task
+        """
+        return (
+            self.cache_provider is not None and task.cache_policy == CachePolicy.NORMAL
+        )
+
+    def _renew_task_lease(self, task: Task, task_params: Payload, task_key: TaskKey):
+        """
+        extend the lease acquired by _get_task_result_or_lease while the task runs
+
+        :param task: the task
+        :param task_params: the params of the task
+        :param task_key: the key of the invocation, see _get_task_key
+        """
+        if self.cache_provider is not None and self._holds_task_lease(task):
+            self.cache_provider.renew(task_key[0], task_params)
+
+    def _release_task_lease(
+        self, task: Task, task_params: Payload, task_key: TaskKey, stored: bool = True
+    ):
+        """
+        release the lease acquired by _get_task_result_or_lease
+
+        :param task: the task
+        :param task_params: the params of the task
+        :param task_key: the key of the invocation, see _get_task_key
+        :param stored: whether the result is cached, otherwise the lease is abandoned
+            so waiting processes compute the task at once
+        """
+        if self.cache_provider is None or not self._holds_task_lease(task):
+            return
+        if stored:
+            self.cache_provider.release(task_key[0], task_params)
+        else:
+            self.cache_provider.abandon(task_key[0], task_params)
+
+    def _get_lease_renew_interval(self) -> Optional[float]:
+        """
+        seconds between renewals of held leases, None if there is no cache provider
+        """
+        if self.cache_provider is None:
+            return None
+        return self.cache_provider.lease_timeout / 3
 
     @abstractmethod
-    def run(self, tasks: list[Task]) -> Payload:
+    def run(self, tasks: list[Task], payload: Optional[Payload] = None) -> Payload:
+        """
+        execute tasks
+
+        :param tasks: list of tasks
+        :param payload: seed params given to the tasks
+        """
         raise NotImplementedError
 
+    def run_many(
+        self, tasks: list[Task], inputs_list: list[Payload]
+    ) -> Iterator[tuple[int, Payload]]:
+        """
+        execute tasks for each seed payload in inputs_list, yield (index, result) as each instance finishes.
+        the default implementation runs the instances one by one
+
+        :param tasks: list of tasks
+        :param inputs_list: list of seed payloads
+        """
+        for i, inputs in enumerate(inputs_list):
+            yield i, self.run(tasks, inputs)
+
 
 class SerialExecuter(Executer):
-    def run(self, tasks: list[Task]) -> Payload:
+    def run(self, tasks: list[Task], payload: Optional[Payload] = None) -> Payload:
         """
         serially execute tasks
 
         :param tasks: list of tasks
+        :param payload: seed params given to the tasks
+        """
+        for _, d_payload in self.run_many(tasks, [payload or {}]):
+            return d_payload
+        raise ValueError("run_many should yield the result of the instance")
+
+    def run_many(
+        self, tasks: list[Task], inputs_list: list[Payload]
+    ) -> Iterator[tuple[int, Payload]]:
+        """
+        serially execute tasks for each seed payload, tasks with identical inputs are executed once
+
+        :param tasks: list of tasks
+        :param inputs_list: list of seed payloads
         """
-        d_payload: Payload = {}  # param -> value
+        done_results: dict[TaskKey, Payload] = {}
+        payloads = [dict(inputs) for inputs in inputs_list]
+        completed: list[list[Task]] = [[] for _ in inputs_list]
+        errors: list[tuple[int, Task, BaseException]] = []
+        for i in range(len(payloads)):
+            instance_errors = self._run_instance(
+                tasks, payloads[i], done_results, completed[i]
+            )
+            if not instance_errors:
+                # keep nothing of a yielded instance, done_results may still be
+                # used by the instances after it
+                yield i, LazyPayload.wrap(_take(payloads, i))
+                continue
+
+            errors.extend((i, task, exc) for task, exc in instance_errors)
+            if self.failure_mode == FailureMode.FAIL_FAST:
+                break
+
+        if errors:
+            raise ExecutionError(errors, payloads, completed) from errors[0][2]
+
+    def _run_instance(
+        self,
+        tasks: list[Task],
+        d_payload: Payload,
+        done_results: dict[TaskKey, Payload],
+        completed: list[Task],
+    ) -> list[tuple[Task, BaseException]]:
+        """
+        serially execute tasks for one instance, return the failed tasks
+
+        :param tasks: list of tasks
+        :param d_payload: param -> value of the instance, starting with the seed params
+        :param done_results: results of invocations already executed, shared between instances
+        :param completed: completed tasks are appended to it
+        """
+        errors: list[tuple[Task, BaseException]] = []
+        instance_keys: set[TaskKey] = set()  # invocations of this instance
         for task in tasks:
             # try to get all the parameters for the task
-            task_params: Payload = {}
-            for param in _get_task_params_names(task):
-                if param in d_payload:
-                    task_params[param] = d_payload[param]
-                else:
-                    raise ValueError(
-                        f"Task parameter {param} not given by previous tasks"
-                    )
-
-            result = self._get_task_result_from_cache(task, task_params)
-            if result is None:
-                logger.debug(f"execute task: {task.__class__.__name__}")
-                result = task._execute(**task_params)
-                self._set_task_result_to_cache(task, task_params, result)
+            params_names = _get_task_params_names(task)
+            missing = [param for param in params_names if param not in d_payload]
+            if missing:
+                if errors:
+                    # maybe given by a failed task
+                    continue
+                raise ValueError(
+                    f"Task parameter {missing[0]} not given by previous tasks"
+                )
+            task_params = _get_task_params(task, d_payload)
+
+            task_key = self._get_task_key(task, task_params)
+            if task_key in instance_keys:
+                # same task with same params, its result is already in d_payload
+                logger.debug(f"duplicate task: {task.__class__.__name__}")
+                completed.append(task)
+                continue
+
+            if task_key in done_results:
+                logger.debug(f"duplicate task: {task.__class__.__name__}")
+                result = done_results[task_key]
             else:
-                logger.debug(f"cache hit task: {task.__class__.__name__}")
+                try:
+                    result = self._get_or_execute_task(task, task_params, task_key)
+                except Exception as e:
+                    logger.debug(f"task failed: {task.__class__.__name__}, {e!r}")
+                    errors.append((task, e))
+                    if self.failure_mode == FailureMode.FAIL_FAST:
+                        break
+                    continue
+            done_results[task_key] = result
+            instance_keys.add(task_key)
 
             # key should be unique
             if any(k in d_payload for k in result.keys()):
                 raise ValueError("Task result keys must be unique")
             d_payload.update(result)
-        return d_payload
+            completed.append(task)
+        return errors
 
+    def _get_or_execute_task(
+        self, task: Task, task_params: Payload, task_key: TaskKey
+    ) -> Payload:
+        """
+        get task result from cache, or execute the task
 
-class MultiprocessExecuter(Executer):
-    def run(self, tasks: list[Task]) -> Payload:
+        :param task: the task
+        :param task_params: the params of the task
+        :param task_key: the key of the invocation, see _get_task_key
         """
-        Execute tasks in parallel using multiprocessing
+        result, leased = self._get_task_result_or_lease(task, task_params, task_key)
+        if result is None and not leased:
+            logger.info(f"wait for other process: {task.__class__.__name__}")
+        while result is None and not leased:
+            time.sleep(self.lease_poll_interval)
+            result, leased = self._get_task_result_or_lease(task, task_params, task_key)
 
-        :param tasks: list of tasks
+        if result is not None:
+            logger.debug(f"cache hit task: {task.__class__.__name__}")
+            return result
+
+        logger.debug(f"execute task: {task.__class__.__name__}")
+        metrics.WORKERS.set(1)
+        metrics.BUSY_WORKERS.set(1)
+        renewer = _LeaseRenewer(self, task, task_params, task_key)
+        # a failed task releases the lease, waiting processes retry it one by one
+        stored = True
+        try:
+            with renewer:
+                result, duration = _execute_task(task, resolve(task_params))
+            self._add_task_timing(task, task_key, duration, result)
+            stored = self._set_task_result_to_cache(
+                task, task_params, task_key, result, duration
+            )
+        finally:
+            metrics.BUSY_WORKERS.set(0)
+            self._release_task_lease(task, task_params, task_key, stored)
+        return result
+
+
+class _LeaseRenewer:
+    """
+    renew the lease of a task in the background while it runs in this process
+    """
+
+    def __init__(
+        self, executer: Executer, task: Task, task_params: Payload, task_key: TaskKey
+    ):
+        self.executer = executer
+        self.task = task
+        self.task_params = task_params
+        self.task_key = task_key
+        self.stopped = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def _run(self, interval: float):
+        while not self.stopped.wait(interval):
+            try:
+                self.executer._renew_task_lease(
+                    self.task, self.task_params, self.task_key
+                )
+            except Exception as e:
+                logger.warning(f"failed to renew lease: {e!r}")
+
+    def __enter__(self):
+        interval = self.executer._get_lease_renew_interval()
+        if interval is not None and self.executer._holds_task_lease(self.task):
+            self.thread = threading.Thread(
+                target=self._run, args=(interval,), daemon=True
+            )
+            self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+
+class _TaskStatus(Enum):
+    NOT_STARTED = 0
+    WAITING = 1  # another process holds the lease of the task
+    QUEUED = 2  # waiting for resources
+    RUNNING = 3
+    DONE = 4
+    FAILED = 5  # the task or a duplicated invocation raised
+
+
+class _RunableTask:
+    """
+    task with running status
+    """
+
+    def __init__(self, task: Task, d_payload: Payload, instance: int, index: int = 0):
+        """
+        :param task: the task
+        :param d_payload: the payload of the instance the task belongs to
+        :param instance: the index of the instance
+        :param index: the index of the task in the task list
+        """
+        self.task = task
+        self.d_payload = d_payload
+        self.instance = instance
+        self.index = index
+
+        self.status = _TaskStatus.NOT_STARTED
+        self.missing = 0  # the number of params not given yet
+        self.task_params: Optional[Payload] = None
+        self.task_key: Optional[TaskKey] = None
+        # median of historical durations, set for tasks that may be speculated
+        self.expected_duration: Optional[float] = None
+
+    def missing_params(self) -> list[str]:
+        """
+        get the parameters not given yet, the task is ready to be executed if there is none
         """
+        return [
+            param
+            for param in _get_task_params_names(self.task)
+            if param not in self.d_payload
+        ]
 
-        d_payload: Payload = {}  # param -> value
 
-        class TaskStatus(Enum):
-            NOT_STARTED = 0
-            RUNNING = 1
-            DONE = 2
+def _get_task_demand(task: Task, capacity: dict[str, float]) -> dict[str, float]:
+    """
+    get the resources in capacity needed by task, a task needing more than
+    the capacity gets all of it, so it runs alone instead of never
 
-        class RunableTask:
-            """
-            task with running status
-            """
+    :param task: the task
+    :param capacity: resource name -> total amount
+    """
+    resources = {"cpus": 1, **task.resources}
+    return {
+        name: min(resources.get(name, 0), total) for name, total in capacity.items()
+    }
 
-            def __init__(self, task: Task):
-                self.task = task
 
-                self.status = TaskStatus.NOT_STARTED
-                self.future: Optional[concurrent.futures.Future] = None
-                self.task_params: Optional[Payload] = None
+def _get_dominant_share(task: Task, capacity: dict[str, float]) -> float:
+    """
+    get the largest fraction of a resource in capacity needed by task
+
+    :param task: the task
+    :param capacity: resource name -> total amount
+    """
+    demand = _get_task_demand(task, capacity)
+    return max(
+        (demand[name] / total for name, total in capacity.items() if total > 0),
+        default=0.0,
+    )
+
+
+class _Scheduler:
+    """
+    scheduling state of one MultiprocessExecuter.run_many call
+    """
+
+    def __init__(
+        self,
+        executer: "MultiprocessExecuter",
+        executor: store.WorkerPool,
+        tasks: list[Task],
+        inputs_list: list[Payload],
+    ):
+        self.executer = executer
+        self.executor = executor
+        self.tasks = tasks
 
-            def is_prepared(self):
-                """
-                Check if the task is ready to be executed
-                """
+        # param -> value, per instance, emptied once the instance is yielded
+        self.d_payloads: list[Payload] = [dict(inputs) for inputs in inputs_list]
+        self.instances: list[list[_RunableTask]] = [
+            [_RunableTask(task, d_payload, i, j) for j, task in enumerate(tasks)]
+            for i, d_payload in enumerate(self.d_payloads)
+        ]
+        self.yielded: set[int] = set()  # finished instances
+        self.finished: list[int] = []  # finished instances not yielded yet
+        # tasks not done, per instance
+        self.remaining = [len(tasks) for _ in inputs_list]
 
-                # if all the parameters are ready, then the task is ready
-                for param in _get_task_params_names(self.task):
-                    if param not in d_payload:
-                        return False
-                return True
+        # tasks whose params are all given, not looked up yet
+        self.ready: collections.deque[_RunableTask] = collections.deque()
+        # (instance, param) -> tasks waiting for the param
+        self.blocked: dict[tuple[int, str], list[_RunableTask]] = {}
+        for instance in self.instances:
+            for rtask in instance:
+                self._block(rtask)
+        self.waiting: list[_RunableTask] = []  # tasks waiting for other processes
 
-        rtasks = [RunableTask(task) for task in tasks]
+        # single-flight: identical invocations share one execution
+        self.inflight: dict[TaskKey, _RunableTask] = {}
+        # unfinished tasks sharing the execution of each invocation
+        self.duplicates: dict[TaskKey, list[_RunableTask]] = {}
+        self.done_results: dict[TaskKey, Payload] = {}
+        # instances given the result of each invocation, the result is dropped, and its
+        # references kept in the workers are freed, once these instances are yielded and
+        # no task that may be the same invocation is still to be looked up
+        self.holders: dict[TaskKey, set[int]] = {}
+        self.held: dict[int, list[TaskKey]] = {}  # instance -> invocations it is given
+        # tasks not looked up yet, per task in the task list
+        self.unprepared = [len(inputs_list) for _ in tasks]
+        self.code_tasks: dict[Code, list[int]] = {}  # task code -> indexes of the tasks
+        for j, task in enumerate(tasks):
+            self.code_tasks.setdefault(_get_task_code(task), []).append(j)
+        # unheld invocations kept for tasks not looked up yet, per task code
+        self.unheld: dict[Code, set[TaskKey]] = {}
+        self.leased: list[_RunableTask] = []  # tasks holding a lease
+        self.renewed_at = time.monotonic()
 
+        # tasks waiting for resources, larger tasks first so smaller ones are packed around them
+        self.queued: list[_RunableTask] = []
+        self.dominant_shares = [
+            _get_dominant_share(task, executer.capacity) for task in tasks
+        ]
+        self.running: dict[concurrent.futures.Future, _RunableTask] = {}
+        self.used: dict[str, float] = {name: 0.0 for name in executer.capacity}
+
+        # speculative execution of stragglers
+        self.started: dict[concurrent.futures.Future, float] = {}
+        self.speculated: set[TaskKey] = set()
+        # futures of losing copies, still occupying a worker
+        self.discarded: dict[concurrent.futures.Future, _RunableTask] = {}
+
+        # object store: the worker running each future
+        self.worker_of: dict[concurrent.futures.Future, int] = {}
+
+        self.failed_keys: dict[TaskKey, BaseException] = {}
+        self.errors: list[tuple[int, Task, BaseException]] = []
+
+    def schedule(self):
+        """
+        resolve prepared tasks from cache and submit them as resources allow
+        """
+        self._renew_leases()
+        self._prepare()
+        self._admit()
+        self._speculate()
+
+        metrics.WORKERS.set(self.executer.max_workers)
+        metrics.BUSY_WORKERS.set(self._busy_workers())
+        metrics.QUEUE_DEPTH.set(len(self.queued))
+
+    def _block(self, rtask: _RunableTask):
+        """
+        make rtask wait for its missing params, or ready if there is none
+        """
+        missing = rtask.missing_params()
+        rtask.missing = len(missing)
+        if not missing:
+            self.ready.append(rtask)
+        for param in missing:
+            self.blocked.setdefault((rtask.instance, param), []).append(rtask)
+
+    def _prepare(self):
+        """
+        resolve tasks that are prepared by duplicates or cache, queue the others
+        """
+        # poll the tasks waiting for other processes
+        waiting, self.waiting = self.waiting, []
+        for rtask in waiting:
+            if rtask.status == _TaskStatus.WAITING:
+                self._lookup(rtask)
+
+        # cached tasks maybe prepare for other tasks
+        while self.ready:
+            rtask = self.ready.popleft()
+            task_params = _get_task_params(rtask.task, rtask.d_payload)
+            rtask.task_params = task_params
+            rtask.task_key = self.executer._get_task_key(rtask.task, task_params)
+            self.unprepared[rtask.index] -= 1
+            self._lookup(rtask)
+            if self.unprepared[rtask.index] == 0:
+                self._drop_unheld(_get_task_code(rtask.task))
+
+    def _lookup(self, rtask: _RunableTask):
+        """
+        resolve a prepared task by a duplicate or cache, queue it if it holds the lease
+        """
+        if rtask.task_params is None or rtask.task_key is None:
+            raise ValueError(f"rtask {rtask} task_params should not be None")
+
+        if rtask.task_key in self.failed_keys:
+            self._fail(rtask, self.failed_keys[rtask.task_key])
+            return
+
+        if rtask.task_key in self.done_results:
+            self._done(rtask, self.done_results[rtask.task_key])
+
+            logger.debug(f"duplicate task: {rtask.task.__class__.__name__}")
+            return
+
+        if rtask.task_key in self.inflight:
+            # finished together with the in-flight invocation
+            rtask.status = _TaskStatus.RUNNING
+            self.duplicates[rtask.task_key].append(rtask)
+
+            logger.debug(f"duplicate task: {rtask.task.__class__.__name__}")
+            return
+
+        result, is_leased = self.executer._get_task_result_or_lease(
+            rtask.task, rtask.task_params, rtask.task_key
+        )
+
+        if result is not None:
+            self.done_results[rtask.task_key] = result
+            self._done(rtask, result)
+
+            logger.debug(f"cache hit task: {rtask.task.__class__.__name__}")
+        elif is_leased:
+            self.leased.append(rtask)
+            self.inflight[rtask.task_key] = rtask
+            self.duplicates[rtask.task_key] = [rtask]
+            bisect.insort(self.queued, rtask, key=self._queue_order)
+            rtask.status = _TaskStatus.QUEUED
+        else:
+            if rtask.status != _TaskStatus.WAITING:
+                rtask.status = _TaskStatus.WAITING
+
+                logger.info(f"wait for other process: {rtask.task.__class__.__name__}")
+            self.waiting.append(rtask)
+
+    def _queue_order(self, rtask: _RunableTask) -> float:
+        """
+        the negative dominant share of the task, queued tasks are sorted by it
+        """
+        return -self.dominant_shares[rtask.index]
+
+    def _admit(self):
+        """
+        submit queued tasks while workers and resources are available,
+        larger tasks first so smaller ones are packed around them
+        """
+        submitted = False
+        for rtask in self.queued:
+            if self._busy_workers() >= self.executer.max_workers:
+                break
+            if not self._fits(rtask):
+                continue
+
+            submitted = True
+            rtask.status = _TaskStatus.RUNNING
+            if self.executer.speculation_factor is not None and rtask.task.idempotent:
+                rtask.expected_duration = self.executer._get_expected_duration(
+                    rtask.task
+                )
+            self._submit(rtask)
+
+            logger.debug(f"submit task: {rtask.task.__class__.__name__}")
+        if submitted:
+            self.queued = [
+                rtask for rtask in self.queued if rtask.status == _TaskStatus.QUEUED
+            ]
+
+    def _speculate(self):
+        """
+        launch a copy of idempotent tasks running much longer than usual on idle workers
+        """
+        if self.executer.speculation_factor is None:
+            return
+
+        now = time.monotonic()
+        for future, rtask in list(self.running.items()):
+            if self._busy_workers() >= self.executer.max_workers:
+                break
+            deadline = self._speculation_deadline(future, rtask)
+            if deadline is None or deadline > now or not self._fits(rtask):
+                continue
+
+            if rtask.task_key is not None:
+                self.speculated.add(rtask.task_key)
+            self._submit(rtask)
+
+            logger.debug(f"speculate task: {rtask.task.__class__.__name__}")
+
+    def _speculation_deadline(
+        self, future: concurrent.futures.Future, rtask: _RunableTask
+    ) -> Optional[float]:
+        """
+        get the time a copy of the running task should be launched, None if never
+        """
+        if (
+            self.executer.speculation_factor is None
+            or rtask.expected_duration is None
+            or rtask.task_key in self.speculated
+        ):
+            return None
+        return (
+            self.started[future]
+            + self.executer.speculation_factor * rtask.expected_duration
+        )
+
+    def _busy_workers(self) -> int:
+        return len(self.running) + len(self.discarded)
+
+    def _fits(self, rtask: _RunableTask) -> bool:
+        """
+        whether the free resources are enough for the task
+        """
+        capacity = self.executer.capacity
+        demand = _get_task_demand(rtask.task, capacity)
+        return all(
+            self.used[name] + demand[name] <= capacity[name] + 1e-9 for name in capacity
+        )
+
+    def _submit(self, rtask: _RunableTask):
+        demand = _get_task_demand(rtask.task, self.executer.capacity)
+        for name in demand:
+            self.used[name] += demand[name]
+        future = self._submit_to_worker(self.executor, rtask)
+        self.running[future] = rtask
+        self.started[future] = time.monotonic()
+
+    def _submit_to_worker(
+        self, pool: store.WorkerPool, rtask: _RunableTask
+    ) -> concurrent.futures.Future:
+        """
+        submit the task to an idle worker. in object store mode, it is the worker
+        keeping most bytes of its params, params kept in other workers are fetched and sent along
+        """
+        if rtask.task_params is None:
+            raise ValueError(f"rtask {rtask} task_params should not be None")
+
+        busy = {self.worker_of[future] for future in [*self.running, *self.discarded]}
+        idle = [w for w in range(self.executer.max_workers) if w not in busy]
+        local: dict[int, int] = {}  # worker -> bytes of params kept in it
+        for value in rtask.task_params.values():
+            if isinstance(value, store.Ref):
+                local[value.worker] = local.get(value.worker, 0) + value.nbytes
+        worker = max(idle, key=lambda w: local.get(w, 0))
+
+        task_params = resolve(rtask.task_params)
+        future: concurrent.futures.Future
+        if not self.executer.object_store:
+            future = pool.submit(worker, _execute_task, rtask.task, task_params)
+            self.worker_of[future] = worker
+            return future
+
+        remote = [
+            name
+            for name, value in task_params.items()
+            if isinstance(value, store.Ref) and value.worker != worker
+        ]
+        # a task never keeps the result of a cache provider without process safety
+        cache_provider = self.executer.cache_provider
+        keep = (
+            cache_provider is None
+            or cache_provider.process_safe
+            or not rtask.task.cache_policy.writable
+        )
+        try:
+            refs = [task_params[name] for name in remote]
+            task_params.update(zip(remote, pool.fetch(refs)))
+            metrics.STORE_FETCHED_BYTES.inc(sum(ref.nbytes for ref in refs))
+        except Exception as e:
+            future = concurrent.futures.Future()
+            future.set_exception(e)
+        else:
+            future = pool.submit(
+                worker,
+                _execute_task_in_store,
+                rtask.task,
+                task_params,
+                rtask.task_key,
+                keep,
+            )
+        self.worker_of[future] = worker
+        return future
+
+    def _resolve(self, d_payload: Payload):
+        """
+        replace the references in d_payload with the values kept in the workers
+        """
+        if not self.executer.object_store:
+            return
+        names = [
+            name for name, value in d_payload.items() if isinstance(value, store.Ref)
+        ]
+        if not names:
+            return
+        refs = [d_payload[name] for name in names]
+        d_payload.update(zip(names, self.executor.fetch(refs)))
+        metrics.STORE_FETCHED_BYTES.inc(sum(ref.nbytes for ref in refs))
+
+    def _resolve_partial(self):
+        """
+        resolve the payloads of unfinished instances before the workers stop, as far as possible
+        """
+        for i, d_payload in enumerate(self.d_payloads):
+            if i in self.yielded:
+                continue
+            try:
+                self._resolve(d_payload)
+            except Exception as e:
+                logger.debug(f"failed to fetch results of instance {i}: {e!r}")
+
+    def _free(self, future: concurrent.futures.Future, rtask: _RunableTask):
+        """
+        give back the resources of a finished or cancelled future
+        """
+        self.started.pop(future, None)
+        self.worker_of.pop(future, None)
+        demand = _get_task_demand(rtask.task, self.executer.capacity)
+        for name in demand:
+            self.used[name] -= demand[name]
+
+    def has_pending(self) -> bool:
+        """
+        whether some tasks are running or waiting for other processes
+        """
+        return bool(self.running) or bool(self.waiting)
+
+    def wait(self) -> set[concurrent.futures.Future]:
+        """
+        wait until some futures are done, the lease poll interval passes
+        while tasks are waiting for other processes, or a straggler should be speculated
+        """
+        has_waiting = bool(self.waiting)
+        if not self.running:
+            time.sleep(self.executer.lease_poll_interval)
+            return set()
+
+        # poll waiting tasks while executing futures
+        timeout = self.executer.lease_poll_interval if has_waiting else None
+        if self._busy_workers() < self.executer.max_workers:
+            deadlines = [
+                deadline
+                for future, rtask in self.running.items()
+                if (deadline := self._speculation_deadline(future, rtask)) is not None
+                and self._fits(rtask)
+            ]
+            if deadlines:
+                until = max(min(deadlines) - time.monotonic(), 0.0)
+                timeout = until if timeout is None else min(timeout, until)
+
+        interval = self.executer._get_lease_renew_interval()
+        if interval is not None and self.leased:
+            until = max(self.renewed_at + interval - time.monotonic(), 0.0)
+            timeout = until if timeout is None else min(timeout, until)
+
+        done, _ = concurrent.futures.wait(
+            [*self.running, *self.discarded],
+            timeout=timeout,
+            return_when=concurrent.futures.FIRST_COMPLETED,
+        )
+        return done
+
+    def complete(self, future: concurrent.futures.Future):
+        """
+        handle the result of a done future
+
+        :param future: the done future
+        """
+        if future in self.discarded:
+            # a losing copy of a speculated task
+            self._free(future, self.discarded.pop(future))
+            if self.executer.object_store and future.exception() is None:
+                result, _, _, samples = future.result()
+                metrics.REGISTRY.merge(samples)
+                self._free_refs(result)
+            return
+
+        rtask = self.running.pop(future)
+        self._free(future, rtask)
+        copies = [copy_future for copy_future, r in self.running.items() if r is rtask]
+
+        if rtask.task_params is None or rtask.task_key is None:
+            raise ValueError(f"rtask {rtask} task_params should not be None")
+
+        cached: Optional[bool] = None
+        failed: Optional[BaseException]
+        try:
+            if self.executer.object_store:
+                result, duration, cached, samples = future.result()
+                metrics.REGISTRY.merge(samples)
+            else:
+                result, duration = future.result()
+        except Exception as e:
+            if copies:
+                # the other copy may still succeed
+                logger.debug(
+                    f"speculated task copy failed: {rtask.task.__class__.__name__}, {e!r}"
+                )
+                return
+            failed = e
+        else:
+            failed = None
+
+        # the first finished copy wins, cancel the others
+        for copy_future in copies:
+            del self.running[copy_future]
+            if copy_future.cancel():
+                self._free(copy_future, rtask)
+            else:
+                # a running process can not be stopped alone, discard its result
+                self.discarded[copy_future] = rtask
+
+        del self.inflight[rtask.task_key]
+
+        if failed is not None:
+            self._release(rtask)
+            logger.debug(f"task failed: {rtask.task.__class__.__name__}, {failed!r}")
+            self.failed_keys[rtask.task_key] = failed
+            for duplicate in self.duplicates.pop(rtask.task_key):
+                self._fail(duplicate, failed)
+            return
+
+        self.done_results[rtask.task_key] = result
+        self.executer._add_task_timing(rtask.task, rtask.task_key, duration, result)
+        if cached is None:
+            cached = self.executer._set_task_result_to_cache(
+                rtask.task, rtask.task_params, rtask.task_key, result, duration
+            )
+        # waiting processes find the result once the lease is released
+        self._release(rtask, cached)
+
+        # duplicated invocations finish together
+        for duplicate in self.duplicates.pop(rtask.task_key):
+            self._done(duplicate, result)
+
+    def _done(self, rtask: _RunableTask, result: Payload):
+        """
+        give the result of an invocation to the instance of rtask, prepare the tasks waiting for it
+        """
+        if rtask.task_key is None:
+            raise ValueError(f"rtask {rtask} task_key should not be None")
+        rtask.status = _TaskStatus.DONE
+        rtask.d_payload.update(result)
+        self.holders.setdefault(rtask.task_key, set()).add(rtask.instance)
+        self.unheld.get(rtask.task_key[0], set()).discard(rtask.task_key)
+        self.held.setdefault(rtask.instance, []).append(rtask.task_key)
+
+        for param in result:
+            for dependent in self.blocked.pop((rtask.instance, param), ()):
+                dependent.missing -= 1
+                if dependent.missing == 0:
+                    self.ready.append(dependent)
+
+        self.remaining[rtask.instance] -= 1
+        if self.remaining[rtask.instance] == 0:
+            self.finished.append(rtask.instance)
+
+    def _drop_unheld(self, code: Code):
+        """
+        drop the unheld results of the task code once no task with it is to be looked up
+        """
+        if any(self.unprepared[j] for j in self.code_tasks.get(code, ())):
+            return
+        for key in self.unheld.pop(code, ()):
+            self._drop_result(key)
+
+    def _drop_result(self, key: TaskKey):
+        """
+        drop the result of an invocation, and the references it keeps in the workers
+        """
+        result = self.done_results.pop(key, None)
+        if result is not None:
+            self._free_refs(result)
+
+    def _free_refs(self, result: Payload):
+        """
+        drop the values of a result kept in the workers
+        """
+        refs = [value for value in result.values() if isinstance(value, store.Ref)]
+        if refs:
+            self.executor.free(refs)
+
+    def _release(self, rtask: _RunableTask, stored: bool = True):
+        """
+        release the lease held for the task, see Executer._release_task_lease
+        """
+        if rtask.task_params is None or rtask.task_key is None:
+            raise ValueError(f"rtask {rtask} task_params should not be None")
+        self.executer._release_task_lease(
+            rtask.task, rtask.task_params, rtask.task_key, stored
+        )
+        self.leased.remove(rtask)
+
+    def _renew_leases(self):
+        """
+        extend the leases held for queued and running tasks, at most once per renew interval
+        """
+        interval = self.executer._get_lease_renew_interval()
+        now = time.monotonic()
+        if interval is None or now - self.renewed_at < interval:
+            return
+        self.renewed_at = now
+        for rtask in self.leased:
+            if rtask.task_params is not None and rtask.task_key is not None:
+                self.executer._renew_task_lease(
+                    rtask.task, rtask.task_params, rtask.task_key
+                )
+
+    def _fail(self, rtask: _RunableTask, exc: BaseException):
+        if rtask.status in (_TaskStatus.DONE, _TaskStatus.FAILED):
+            return
+        rtask.status = _TaskStatus.FAILED
+        self.errors.append((rtask.instance, rtask.task, exc))
+
+    def abort(self, timeout: float):
+        """
+        cancel queued and pending tasks, terminate running workers
+
+        :param timeout: seconds to wait for workers to exit before killing them
+        """
+        self.queued.clear()
+        self._resolve_partial()
+        futures = [*self.running, *self.discarded]
+        for future in futures:
+            future.cancel()
+        if any(not future.done() for future in futures):
+            self.executor.terminate_workers(timeout)
+        self.running.clear()
+        self.discarded.clear()
+
+    def pop_finished_instances(self) -> list[int]:
+        """
+        get instances finished since the last call, their payloads are taken by take
+        """
+        finished, self.finished = self.finished, []
+        for i in finished:
+            self._resolve(self.d_payloads[i])
+            self.instances[i] = []
+        self.yielded.update(finished)
+
+        # a later duplicate of a dropped invocation looks it up again
+        for i in finished:
+            for key in self.held.pop(i, ()):
+                holders = self.holders.get(key)
+                if holders is None:
+                    continue
+                holders.discard(i)
+                if not holders:
+                    del self.holders[key]
+                    self.unheld.setdefault(key[0], set()).add(key)
+                    self._drop_unheld(key[0])
+        return finished
+
+    def take(self, i: int) -> Payload:
+        """
+        get the payload of a finished instance, the scheduler keeps nothing of it afterwards
+
+        :param i: the index of the instance, returned by pop_finished_instances
+        """
+        return _take(self.d_payloads, i)
+
+    def close(self):
+        """
+        release the leases still held, stop losing copies of speculated tasks
+        """
+        if self.errors:
+            self._resolve_partial()
+        if any(not future.done() for future in self.discarded):
+            self.executor.terminate_workers(self.executer.terminate_timeout)
+        self.discarded.clear()
+
+        for rtask in list(self.leased):
+            self._release(rtask)
+
+        metrics.BUSY_WORKERS.set(0)
+        metrics.QUEUE_DEPTH.set(0)
+
+    def check_finished(self):
+        """
+        raise if some tasks failed or never ran
+        """
+        if self.errors:
+            completed = [
+                list(self.tasks)
+                if i in self.yielded
+                else [
+                    rtask.task for rtask in instance if rtask.status == _TaskStatus.DONE
+                ]
+                for i, instance in enumerate(self.instances)
+            ]
+            raise ExecutionError(
+                self.errors, self.d_payloads, completed
+            ) from self.errors[0][2]
+
+        for rtask in (rtask for instance in self.instances for rtask in instance):
+            if rtask.status == _TaskStatus.NOT_STARTED:
+                raise ValueError(
+                    f"rtask {rtask} is not started, maybe parameters are not satisfied"
+                )
+            elif rtask.status != _TaskStatus.DONE:
+                raise ValueError(
+                    f"rtask {rtask} is still running, while no futures are running"
+                )
+
+
+class MultiprocessExecuter(Executer):
+    def __init__(
+        self,
+        cache_provider: Optional[CacheProvider] = None,
+        lease_poll_interval: float = 1.0,
+        max_workers: Optional[int] = None,
+        capacity: Optional[dict[str, float]] = None,
+        failure_mode: FailureMode = FailureMode.FAIL_FAST,
+        cache_admission: Optional[CacheAdmission] = None,
+        terminate_timeout: float = 5.0,
+        speculation_factor: Optional[float] = None,
+        speculation_min_history: int = 3,
+        object_store: bool = False,
+    ):
+        """
+        :param cache_provider: cache task execution result to avoid re-execution for the same input
+        :param lease_poll_interval: seconds between cache lookups while another process computes the same task
+        :param max_workers: the number of worker processes, default to the number of cpus
+        :param capacity: total resources shared by running tasks, e.g. {"cpus": 16, "memory": 64 * 1024**3},
+            cpus default to max_workers, resources not given are unlimited
+        :param failure_mode: stop on the first failed task, or finish the independent branches
+        :param cache_admission: cache only the results that pay off, default to cache all results
+        :param terminate_timeout: seconds running workers get to exit after a failure in fail-fast mode
+        :param speculation_factor: launch a copy of an idempotent task on an idle worker once it runs
+            speculation_factor times longer than its historical median, None to disable
+        :param speculation_min_history: the number of historical timings needed to speculate a task
+        :param object_store: keep results in the worker producing them and run consumers on
+            the worker keeping most of their input bytes, results are fetched only when another
+            worker needs them or the run returns
+        """
+        super().__init__(
+            cache_provider, lease_poll_interval, failure_mode, cache_admission
+        )
+        self.terminate_timeout = terminate_timeout
+        self.speculation_factor = speculation_factor
+        self.speculation_min_history = speculation_min_history
+        self.object_store = object_store
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.capacity: dict[str, float] = {"cpus": self.max_workers, **(capacity or {})}
+
+    def _get_expected_duration(self, task: Task) -> Optional[float]:
+        """
+        get the median of historical durations of the task, None if the history is too short
+
+        :param task: the task
+        """
+        if self.cache_provider is None:
+            return None
+        timings = self.cache_provider.get_timings(_get_task_code(task))
+        if len(timings) < self.speculation_min_history:
+            return None
+        return statistics.median(timing.duration for timing in timings)
+
+    def run(self, tasks: list[Task], payload: Optional[Payload] = None) -> Payload:
+        """
+        Execute tasks in parallel using multiprocessing
+
+        :param tasks: list of tasks
+        :param payload: seed params given to the tasks
+        """
+        for _, d_payload in self.run_many(tasks, [payload or {}]):
+            return d_payload
+        raise ValueError("run_many should yield the result of the instance")
+
+    def run_many(
+        self, tasks: list[Task], inputs_list: list[Payload]
+    ) -> Iterator[tuple[int, Payload]]:
+        """
+        Execute tasks for each seed payload as one combined graph on one process pool,
+        tasks with identical inputs are executed once
+
+        :param tasks: list of tasks
+        :param inputs_list: list of seed payloads
+        """
         ctx = multiprocessing.get_context(
             "spawn"
         )  # https://docs.python.org/3/whatsnew/3.12.html#:~:text=101588%20%E4%B8%AD%E8%B4%A1%E7%8C%AE%E3%80%82%EF%BC%89-,multiprocessing,-%3A%20In%20Python%203.14
-        with concurrent.futures.ProcessPoolExecutor(mp_context=ctx) as executor:
-            futures: list[concurrent.futures.Future] = []  # executing futures
-
-            def _submit_prepared_tasks() -> None:
-                """
-                submit tasks that are prepared in rtasks
-                """
-                cache_prepared_tasks: list[RunableTask] = (
-                    []
-                )  # tasks that are prepared by cache
-                for rtask in rtasks:
-                    if rtask.status == TaskStatus.NOT_STARTED and rtask.is_prepared():
-                        task_params = {}
-                        for param in _get_task_params_names(rtask.task):
-                            task_params[param] = d_payload[param]
-
-                        rtask.task_params = task_params
-
-                        result = self._get_task_result_from_cache(
-                            rtask.task, task_params
-                        )
-
-                        if result is not None:
-                            d_payload.update(result)
-                            rtask.status = TaskStatus.DONE
-                            cache_prepared_tasks.append(rtask)
-
-                            logger.debug(
-                                f"cache hit task: {rtask.task.__class__.__name__}"
-                            )
-                        else:
-                            rtask.status = TaskStatus.RUNNING
-                            future = executor.submit(rtask.task._execute, **task_params)
-                            futures.append(future)
-                            rtask.future = future
-
-                            logger.debug(
-                                f"submit task: {rtask.task.__class__.__name__}"
-                            )
-
-                if cache_prepared_tasks:
-                    # cached tasks maybe prepare for other tasks
-                    _submit_prepared_tasks()
-
-            # get the task that is done
-            def wait_until_any(futures: list[concurrent.futures.Future]):
-                for f in concurrent.futures.as_completed(futures):
-                    return f
-                raise ValueError("No task is done")
-
-            _submit_prepared_tasks()
-            while futures:
-                future = wait_until_any(futures)
-                futures.remove(future)
-
-                result = future.result()
-                rtask = next(
-                    rtask for rtask in rtasks if rtask.future == future
-                )  # find rtask by future
-                if rtask.task_params is None:
-                    raise ValueError(f"rtask {rtask} task_params should not be None")
-                self._set_task_result_to_cache(rtask.task, rtask.task_params, result)
-                rtask.status = TaskStatus.DONE
-                d_payload.update(result)
-
-                _submit_prepared_tasks()
-
-            for rtask in rtasks:
-                if rtask.status == TaskStatus.NOT_STARTED:
-                    raise ValueError(
-                        f"rtask {rtask} is not started, maybe parameters are not satisfied"
-                    )
-                elif rtask.status == TaskStatus.RUNNING:
-                    raise ValueError(
-                        f"rtask {rtask} is still running, while no futures are running"
-                    )
-
-        return d_payload
+        initializer = None
+        initargs: tuple = ()
+        if self.object_store:
+            # workers cache results themselves if they can share the cache provider
+            worker_executer = copy.copy(self)
+            if self.cache_provider is not None and not self.cache_provider.process_safe:
+                worker_executer.cache_provider = None
+            initializer, initargs = (
+                _init_store_worker,
+                (worker_executer, metrics.REGISTRY.enabled),
+            )
+        executor = store.WorkerPool(self.max_workers, ctx, initializer, initargs)
+        with executor:
+            scheduler = _Scheduler(self, executor, tasks, inputs_list)
+            try:
+                scheduler.schedule()
+                for i in scheduler.pop_finished_instances():
+                    yield i, LazyPayload.wrap(scheduler.take(i))
+
+                while scheduler.has_pending():
+                    for future in scheduler.wait():
+                        scheduler.complete(future)
+
+                    if scheduler.errors and self.failure_mode == FailureMode.FAIL_FAST:
+                        scheduler.abort(self.terminate_timeout)
+                        break
+
+                    scheduler.schedule()
+                    for i in scheduler.pop_finished_instances():
+                        yield i, LazyPayload.wrap(scheduler.take(i))
+            finally:
+                scheduler.close()
+
+            scheduler.check_finished()
@@ -0,0 +1,254 @@
+import hashlib
+import pickle
+import threading
+from collections.abc import Buffer
+from pathlib import PurePath, Path
+from typing import Any, Callable, Optional, Protocol
+
+
+class Hasher(Protocol):
+    """
+    a hashlib hasher, e.g. hashlib.blake2b()
+    """
+
+    def update(self, data: Buffer, /) -> None: ...
+
+
+Fingerprinter = Callable[[Any, Hasher], None]
+
+# type -> fingerprinter, looked up along the MRO of the value
+_registry: dict[type, Fingerprinter] = {}
+
+_CHUNK_SIZE = 1 << 20
+
+# whether the value being fingerprinted in this thread depends on the file system
+_volatile = threading.local()
+# ids of the objects being fingerprinted in this thread, to stop at reference cycles
+_active = threading.local()
+
+
+class Fingerprinted:
+    """
+    stand-in for a value whose fingerprint is already known, e.g. a reference to a result
+    kept in another process, it is fingerprinted as the value itself
+    """
+
+    def __init__(self, digest: str):
+        """
+        :param digest: the fingerprint of the value
+        """
+        self._digest = digest
+
+    @property
+    def digest(self) -> str:
+        """
+        the fingerprint of the value
+        """
+        return self._digest
+
+
+class FingerprintedDict(dict, Fingerprinted):
+    """
+    dict with its fingerprint computed once, e.g. the params of an invocation
+    passed to several cache provider calls, it must not be modified
+    """
+
+    def __init__(self, items: dict, digest: Optional[str] = None):
+        """
+        :param items: the items of the dict
+        :param digest: the fingerprint of items, computed if None
+        """
+        dict.__init__(self, items)
+        if digest is None:
+            digest = fingerprint(
+                items if isinstance(items, Fingerprinted) else dict(items)
+            )
+        Fingerprinted.__init__(self, digest)
+
+
+def register(cls: type, fingerprinter: Fingerprinter):
+    """
+    register a fingerprinter for values of type cls (and its subclasses)
+
+    :param cls: the type of values handled by the fingerprinter
+    :param fingerprinter: callable(value, hasher) that feeds the value into the hasher
+    """
+    _registry[cls] = fingerprinter
+
+
+def update(hasher: Hasher, value: Any):
+    """
+    feed value into hasher incrementally
+
+    :param hasher: a hashlib hasher, e.g. hashlib.blake2b()
+    :param value: the value to fingerprint
+    """
+    hook = getattr(value, "__tasksflow_fingerprint__", None)
+    if hook is not None and not isinstance(value, type):
+        _update_tag(hasher, b"hook", type(value))
+        update(hasher, hook())
+        return
+
+    for cls in type(value).__mro__:
+        fingerprinter = _registry.get(cls)
+        if fingerprinter is not None:
+            _update_tag(hasher, cls.__qualname__.encode(), type(value))
+            fingerprinter(value, hasher)
+            return
+
+    if _is_buffer(value):
+        _update_tag(hasher, b"buffer", type(value))
+        _update_buffer(value, hasher)
+        return
+
+    state = _get_state(value)
+    if state is not None:
+        _update_object(value, state, hasher)
+        return
+
+    # fallback for everything else
+    _update_tag(hasher, b"pickle", type(value))
+    _update_bytes(pickle.dumps(value), hasher)
+
+
+def fingerprint(value: Any) -> str:
+    """
+    get a stable fingerprint of value, used as cache key
+
+    :param value: the value to fingerprint
+    """
+    if isinstance(value, Fingerprinted):
+        return value.digest
+    hasher = hashlib.blake2b(digest_size=32)
+    update(hasher, value)
+    return hasher.hexdigest()
+
+
+def _update_tag(hasher: Hasher, tag: bytes, cls: type):
+    name = f"{cls.__module__}.{cls.__qualname__}".encode()
+    hasher.update(len(tag).to_bytes(4, "little"))
+    hasher.update(tag)
+    hasher.update(len(name).to_bytes(4, "little"))
+    hasher.update(name)
+
+
+def stable_fingerprint(value: Any) -> Optional[str]:
+    """
+    get the fingerprint of value if it can be stored and reused later,
+    None if it depends on the file system, i.e. the value holds paths at any depth
+
+    :param value: the value to fingerprint
+    """
+    _volatile.value = False
+    digest = fingerprint(value)
+    return None if _volatile.value else digest
+
+
+def _get_state(value: Any) -> Any:
+    """
+    get the state of a plain object, e.g. a dataclass, None for other values.
+    its pickle may differ between processes, e.g. it holds sets of strings
+    """
+    cls = type(value)
+    if (
+        cls.__module__ == "builtins"
+        or cls.__reduce_ex__ is not object.__reduce_ex__
+        or cls.__reduce__ is not object.__reduce__
+    ):
+        return None
+    return value.__getstate__()
+
+
+def _update_object(value: Any, state: Any, hasher: Hasher):
+    """
+    hash a plain object as its type and its state
+    """
+    active: set[int] = _active.__dict__.setdefault("ids", set())
+    if id(value) in active:
+        _update_tag(hasher, b"cycle", type(value))
+        return
+    active.add(id(value))
+    try:
+        _update_tag(hasher, b"object", type(value))
+        update(hasher, state)
+    finally:
+        active.discard(id(value))
+
+
+def _update_bytes(data: bytes | memoryview, hasher: Hasher):
+    hasher.update(len(data).to_bytes(8, "little"))
+    hasher.update(data)
+
+
+def _is_buffer(value: Any) -> bool:
+    try:
+        memoryview(value)
+    except TypeError:
+        return False
+    return True
+
+
+def _update_buffer(value: Any, hasher: Hasher):
+    """
+    hash a buffer (bytes, bytearray, numpy array, ...) without copying it
+    """
+    view = memoryview(value)
+    update(hasher, (view.format, view.shape))
+    if not view.c_contiguous:
+        # tobytes() copies into C order, only for non-contiguous buffers
+        view = memoryview(view.tobytes())
+    view = view.cast("B")
+    hasher.update(view.nbytes.to_bytes(8, "little"))
+    for start in range(0, view.nbytes, _CHUNK_SIZE):
+        hasher.update(view[start : start + _CHUNK_SIZE])
+
+
+def _update_str(value: str, hasher: Hasher):
+    _update_bytes(value.encode("utf-8", "surrogatepass"), hasher)
+
+
+def _update_scalar(value: Any, hasher: Hasher):
+    _update_bytes(repr(value).encode(), hasher)
+
+
+def _update_sequence(value: list | tuple, hasher: Hasher):
+    hasher.update(len(value).to_bytes(8, "little"))
+    for item in value:
+        update(hasher, item)
+
+
+def _update_set(value: set | frozenset, hasher: Hasher):
+    # order of set iteration is not stable, so sort by item fingerprints
+    items = sorted(fingerprint(item) for item in value)
+    _update_sequence(items, hasher)
+
+
+def _update_dict(value: dict, hasher: Hasher):
+    # dicts with the same items are equal regardless of insertion order
+    items = sorted((fingerprint(k), fingerprint(v)) for k, v in value.items())
+    _update_sequence(items, hasher)
+
+
+def _update_path(value: PurePath, hasher: Hasher):
+    """
+    a path is identified by its location, and for existing files also by mtime and size
+    """
+    _volatile.value = True
+    _update_str(str(value), hasher)
+    if isinstance(value, Path) and value.exists():
+        stat = value.stat()
+        update(hasher, (stat.st_mtime_ns, stat.st_size))
+
+
+register(type(None), _update_scalar)
+register(bool, _update_scalar)
+register(int, _update_scalar)
+register(float, _update_scalar)
+register(complex, _update_scalar)
+register(str, _update_str)
+register(list, _update_sequence)
+register(tuple, _update_sequence)
+register(set, _update_set)
+register(frozenset, _update_set)
+register(dict, _update_dict)
+register(PurePath, _update_path)
@@ -0,0 +1,403 @@
+import math
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Optional, TypeVar
+
+Labels = tuple[str, ...]  # label values, in the order of labelnames
+
+
+class Metric(ABC):
+    """
+    base class of metrics, a metric is a family of samples identified by label values
+    """
+
+    type_name = ""
+    # label values -> recorded value, the type depends on the metric
+    values: dict
+
+    def __init__(
+        self,
+        registry: "MetricsRegistry",
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+    ):
+        """
+        :param registry: the registry the metric belongs to
+        :param name: the name of the metric, e.g. tasksflow_cache_hits_total
+        :param help: the description of the metric
+        :param labelnames: the names of the labels
+        """
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+
+    def _labels(self, labels: dict[str, str]) -> Labels:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"metric {self.name} expects labels {self.labelnames}, but get {tuple(labels)}"
+            )
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _format_labels(self, labels: Labels, extra: str = "") -> str:
+        pairs = [
+            f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, labels)
+        ]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    @abstractmethod
+    def clear(self):
+        """
+        drop all the samples
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def _expose(self) -> list[str]:
+        """
+        get the sample lines in the Prometheus text format
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def _merge(self, values: dict):
+        """
+        add the values recorded by the same metric in another process, see MetricsRegistry.drain
+        """
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """
+    a value that only goes up
+    """
+
+    type_name = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values: dict[Labels, float] = {}
+
+    def inc(self, value: float = 1, **labels: str):
+        if not self.registry.enabled:
+            return
+        key = self._labels(labels)
+        with self.registry.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def _merge(self, values: dict[Labels, float]):
+        for key, value in values.items():
+            self.values[key] = self.values.get(key, 0) + value
+
+    def value(self, **labels: str) -> float:
+        return self.values.get(self._labels(labels), 0)
+
+    def clear(self):
+        self.values.clear()
+
+    def _expose(self) -> list[str]:
+        return [
+            f"{self.name}{self._format_labels(labels)} {_format_value(value)}"
+            for labels, value in self.values.items()
+        ]
+
+
+class Gauge(Metric):
+    """
+    a value that goes up and down
+    """
+
+    type_name = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values: dict[Labels, float] = {}
+
+    def set(self, value: float, **labels: str):
+        if not self.registry.enabled:
+            return
+        key = self._labels(labels)
+        with self.registry.lock:
+            self.values[key] = value
+
+    def _merge(self, values: dict[Labels, float]):
+        self.values.update(values)
+
+    def value(self, **labels: str) -> float:
+        return self.values.get(self._labels(labels), 0)
+
+    def clear(self):
+        self.values.clear()
+
+    def _expose(self) -> list[str]:
+        return [
+            f"{self.name}{self._format_labels(labels)} {_format_value(value)}"
+            for labels, value in self.values.items()
+        ]
+
+
+# seconds, from a fast cache lookup to a multi-hour task
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.005,
+    0.01,
+    0.05,
+    0.1,
+    0.5,
+    1.0,
+    5.0,
+    10.0,
+    60.0,
+    300.0,
+    3600.0,
+)
+
+
+class Histogram(Metric):
+    """
+    distribution of observed values in cumulative buckets
+    """
+
+    type_name = "histogram"
+
+    def __init__(self, *args, buckets: tuple[float, ...] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> (bucket counts, sum, count)
+        self.values: dict[Labels, tuple[list[int], float, int]] = {}
+
+    def observe(self, value: float, **labels: str):
+        if not self.registry.enabled:
+            return
+        key = self._labels(labels)
+        with self.registry.lock:
+            counts, total, count = self.values.get(
+                key, ([0] * len(self.buckets), 0.0, 0)
+            )
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value, count + 1)
+
+    def _merge(self, values: dict[Labels, tuple[list[int], float, int]]):
+        for key, (counts, total, count) in values.items():
+            old_counts, old_total, old_count = self.values.get(
+                key, ([0] * len(self.buckets), 0.0, 0)
+            )
+            self.values[key] = (
+                [a + b for a, b in zip(old_counts, counts)],
+                old_total + total,
+                old_count + count,
+            )
+
+    def count(self, **labels: str) -> int:
+        value = self.values.get(self._labels(labels))
+        return value[2] if value is not None else 0
+
+    def sum(self, **labels: str) -> float:
+        value = self.values.get(self._labels(labels))
+        return value[1] if value is not None else 0.0
+
+    def clear(self):
+        self.values.clear()
+
+    def _expose(self) -> list[str]:
+        lines = []
+        for labels, (counts, total, count) in self.values.items():
+            for bound, bucket_count in zip(self.buckets, counts):
+                le = f'le="{_format_value(bound)}"'
+                lines.append(
+                    f"{self.name}_bucket{self._format_labels(labels, le)} {bucket_count}"
+                )
+            inf = 'le="+Inf"'
+            lines.append(
+                f"{self.name}_bucket{self._format_labels(labels, inf)} {count}"
+            )
+            lines.append(
+                f"{self.name}_sum{self._format_labels(labels)} {_format_value(total)}"
+            )
+            lines.append(f"{self.name}_count{self._format_labels(labels)} {count}")
+        return lines
+
+
+M = TypeVar("M", bound=Metric)
+
+
+class MetricsRegistry:
+    """
+    registry of metrics, updates are ignored while it is disabled
+    """
+
+    def __init__(self, enabled: bool = False):
+        """
+        :param enabled: whether to record updates
+        """
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.metrics: dict[str, Metric] = {}
+
+    def _register(self, metric: M) -> M:
+        if metric.name in self.metrics:
+            raise ValueError(f"metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(
+        self, name: str, help: str, labelnames: tuple[str, ...] = ()
+    ) -> Counter:
+        return self._register(Counter(self, name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(self, name, help, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(self, name, help, labelnames, buckets=buckets))
+
+    def get(self, name: str) -> Optional[Metric]:
+        return self.metrics.get(name)
+
+    def clear(self):
+        """
+        reset all recorded values
+        """
+        with self.lock:
+            for metric in self.metrics.values():
+                metric.clear()
+
+    def drain(self) -> dict[str, dict]:
+        """
+        get the values recorded since the last drain and reset them,
+        e.g. in a worker process to send them to the registry of the parent, see merge
+        """
+        with self.lock:
+            values = {
+                name: dict(metric.values)
+                for name, metric in self.metrics.items()
+                if metric.values
+            }
+            for name in values:
+                self.metrics[name].clear()
+        return values
+
+    def merge(self, values: dict[str, dict]):
+        """
+        add the values drained from the registry of another process
+
+        :param values: metric name -> values, see drain
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            for name, metric_values in values.items():
+                metric = self.metrics.get(name)
+                if metric is not None:
+                    metric._merge(metric_values)
+
+    def to_prometheus(self) -> str:
+        """
+        dump all metrics in the Prometheus text exposition format
+        """
+        lines = []
+        with self.lock:
+            for metric in self.metrics.values():
+                lines.append(f"# HELP {metric.name} {_escape_help(metric.help)}")
+                lines.append(f"# TYPE {metric.name} {metric.type_name}")
+                lines.extend(metric._expose())
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: Path):
+        """
+        write all metrics in the Prometheus text exposition format to path,
+        e.g. for the textfile collector of node_exporter
+
+        :param path: the file to write
+        """
+        tmp_path = path.with_name(path.name + ".tmp")
+        tmp_path.write_text(self.to_prometheus())
+        tmp_path.replace(path)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _escape_help(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+# the default registry updated by cache providers and executers
+REGISTRY = MetricsRegistry()
+
+
+def enable():
+    """
+    start recording metrics in the default registry
+    """
+    REGISTRY.enabled = True
+
+
+def disable():
+    """
+    stop recording metrics in the default registry
+    """
+    REGISTRY.enabled = False
+
+
+CACHE_LOOKUPS = REGISTRY.counter(
+    "tasksflow_cache_lookups_total", "Cache lookups.", ("provider", "result")
+)
+CACHE_LOOKUP_SECONDS = REGISTRY.histogram(
+    "tasksflow_cache_lookup_seconds", "Latency of cache lookups.", ("provider",)
+)
+CACHE_WRITES = REGISTRY.counter(
+    "tasksflow_cache_writes_total", "Cache writes.", ("provider",)
+)
+CACHE_READ_BYTES = REGISTRY.counter(
+    "tasksflow_cache_read_bytes_total",
+    "Bytes of serialized results read from the cache.",
+    ("provider",),
+)
+CACHE_WRITTEN_BYTES = REGISTRY.counter(
+    "tasksflow_cache_written_bytes_total",
+    "Bytes of serialized results written to the cache.",
+    ("provider",),
+)
+CACHE_EVICTIONS = REGISTRY.counter(
+    "tasksflow_cache_evictions_total",
+    "Cache records removed by clear(remain_records).",
+    ("provider",),
+)
+TASKS_EXECUTED = REGISTRY.counter(
+    "tasksflow_tasks_executed_total", "Tasks executed.", ("task",)
+)
+TASK_DURATION_SECONDS = REGISTRY.histogram(
+    "tasksflow_task_duration_seconds", "Duration of task executions.", ("task",)
+)
+QUEUE_DEPTH = REGISTRY.gauge(
+    "tasksflow_queue_depth", "Submitted tasks waiting for a worker."
+)
+WORKERS = REGISTRY.gauge("tasksflow_workers", "Workers of the running executer.")
+BUSY_WORKERS = REGISTRY.gauge("tasksflow_busy_workers", "Workers executing a task.")
+STORE_FETCHED_BYTES = REGISTRY.counter(
+    "tasksflow_store_fetched_bytes_total",
+    "Estimated bytes of results fetched from the workers keeping them.",
+)
@@ -0,0 +1,247 @@
+from .common import Payload
+from .task import Task
+from .cache import CacheProvider
+from .executer import _get_task_code, _get_task_params_names
+from .fingerprint import Fingerprinted
+from enum import Enum
+from typing import Optional
+import statistics
+
+
+class StepStatus(Enum):
+    CACHED = "cached"  # the result is in cache
+    EXECUTE = "execute"  # the task will be executed
+    UNSATISFIED = "unsatisfied"  # some parameters are given by no task
+    UNKNOWN = "unknown"  # depends on tasks whose outputs can not be predicted
+
+
+class PlanStep:
+    """
+    predicted execution of a task
+    """
+
+    def __init__(self, task: Task):
+        self.task = task
+        self.name = task.__class__.__name__
+        self.params = _get_task_params_names(task)
+
+        self.status = StepStatus.UNKNOWN
+        self.missing_params: list[str] = []
+        # predicted keys of the result, None if the task never ran before
+        self.outputs: Optional[tuple[str, ...]] = None
+        # median of historical durations, None if the task never ran before
+        self.estimated_duration: Optional[float] = None
+
+        # estimated start and finish time with unlimited workers
+        self.start = 0.0
+        self.finish = 0.0
+        # the step finishing last among dependencies
+        self.predecessor: Optional["PlanStep"] = None
+        # producers of params, None for seed payload
+        self.sources: list[Optional["PlanStep"]] = []
+
+    def __repr__(self):
+        return f"PlanStep({self.name}, {self.status.value})"
+
+
+class Plan:
+    """
+    execution plan of tasks, see explain
+    """
+
+    def __init__(self, steps: list[PlanStep], duplicate_keys: dict[str, list[str]]):
+        """
+        :param steps: the steps in the order of tasks
+        :param duplicate_keys: output key -> names of the tasks (or "payload") giving it
+        """
+        self.steps = steps
+        self.duplicate_keys = duplicate_keys
+
+        last = max(steps, key=lambda step: step.finish, default=None)
+        self.estimated_duration = last.finish if last is not None else 0.0
+        self.serial_duration = sum(step.estimated_duration or 0.0 for step in steps)
+
+        self.critical_path: list[PlanStep] = []
+        while last is not None:
+            self.critical_path.insert(0, last)
+            last = last.predecessor
+
+    @property
+    def unsatisfied(self) -> list[PlanStep]:
+        return [step for step in self.steps if step.status == StepStatus.UNSATISFIED]
+
+    @property
+    def has_unknown_durations(self) -> bool:
+        """
+        whether some tasks to execute have no historical timings, so the estimation is a lower bound
+        """
+        return any(
+            step.status == StepStatus.EXECUTE and step.estimated_duration is None
+            for step in self.steps
+        )
+
+    def is_valid(self) -> Optional[bool]:
+        """
+        whether the run would not fail on unsatisfied parameters or duplicate output keys.
+        None if it can not be decided, i.e. some tasks to execute have no historical timings
+        so their outputs, and whether the tasks depending on them are satisfied, are unknown
+        """
+        if self.unsatisfied or self.duplicate_keys:
+            return False
+        if any(
+            step.status == StepStatus.UNKNOWN
+            or (step.status == StepStatus.EXECUTE and step.outputs is None)
+            for step in self.steps
+        ):
+            return None
+        return True
+
+    def __str__(self):
+        lines = [f"{'task':<24} {'status':<12} {'duration':>10} {'finish':>10}"]
+        for step in self.steps:
+            duration = (
+                f"{step.estimated_duration:.2f}s"
+                if step.estimated_duration is not None
+                else "?"
+            )
+            line = f"{step.name:<24} {step.status.value:<12} {duration:>10} {step.finish:>9.2f}s"
+            if step.missing_params:
+                line += f"  missing: {', '.join(step.missing_params)}"
+            lines.append(line)
+
+        path = " -> ".join(step.name for step in self.critical_path)
+        lines.append(
+            f"estimated duration: {self.estimated_duration:.2f}s (critical path: {path})"
+        )
+        lines.append(f"serial duration: {self.serial_duration:.2f}s")
+        if self.has_unknown_durations:
+            lines.append(
+                "some tasks have no historical timings, durations are lower bounds"
+            )
+        for key, names in self.duplicate_keys.items():
+            lines.append(f"duplicate output key {key}: {', '.join(names)}")
+        return "\n".join(lines)
+
+
+def explain(
+    tasks: list[Task],
+    cache_provider: Optional[CacheProvider] = None,
+    payload: Optional[Payload] = None,
+    serial: bool = False,
+) -> Plan:
+    """
+    resolve the dependency graph of tasks without running them.
+    a task is predicted as cached if all its params are known and the cache has its result,
+    otherwise its outputs and duration are predicted from historical timings in cache_provider
+
+    :param tasks: list of tasks
+    :param cache_provider: the cache provider used by the run
+    :param payload: seed params given to the tasks
+    :param serial: whether the tasks run one by one in list order, e.g. by SerialExecuter,
+        so params must be given by previous tasks
+    """
+    values: Payload = dict(payload or {})  # params with known values
+    producers: dict[str, Optional[PlanStep]] = {
+        key: None for key in values
+    }  # param -> step giving it, None for seed payload
+    duplicate_keys: dict[str, list[str]] = {}
+
+    def _resolve(step: PlanStep):
+        task_code = _get_task_code(step.task)
+        digests = None
+        if (
+            cache_provider is not None
+            and step.task.cache_policy.readable
+            and all(param in values for param in step.params)
+        ):
+            task_params = {param: values[param] for param in step.params}
+            # the values are not read, tasks using them are looked up by their fingerprints
+            digests = cache_provider.get_digests(task_code, task_params)
+
+        if digests is not None:
+            step.status = StepStatus.CACHED
+            step.outputs = tuple(digests.keys())
+            step.estimated_duration = 0.0
+            for key, digest in digests.items():
+                if digest is None:
+                    # fingerprinted from the value when read, its value stays unknown
+                    values.pop(key, None)
+                else:
+                    values[key] = Fingerprinted(digest)
+        else:
+            step.status = StepStatus.EXECUTE
+            timings = (
+                cache_provider.get_timings(task_code)
+                if cache_provider is not None
+                else []
+            )
+            if timings:
+                step.outputs = timings[-1].keys
+                step.estimated_duration = statistics.median(
+                    timing.duration for timing in timings
+                )
+
+        step.sources = [producers[param] for param in step.params]
+        step.predecessor = max(
+            (source for source in step.sources if source is not None),
+            key=lambda source: source.finish,
+            default=None,
+        )
+        if step.predecessor is not None:
+            step.start = step.predecessor.finish
+        step.finish = step.start + (step.estimated_duration or 0.0)
+
+        for key in step.outputs or ():
+            if key not in producers:
+                producers[key] = step
+                continue
+            producer = producers[key]
+            if (
+                producer is not None
+                and _get_task_code(producer.task) == _get_task_code(step.task)
+                and producer.sources == step.sources
+            ):
+                # identical invocation, executed once
+                continue
+            names = duplicate_keys.setdefault(
+                key, [producer.name if producer is not None else "payload"]
+            )
+            names.append(step.name)
+
+    steps = [PlanStep(task) for task in tasks]
+    if serial:
+        unpredictable = False
+        for step in steps:
+            if all(param in producers for param in step.params):
+                _resolve(step)
+                unpredictable |= step.outputs is None
+                continue
+            step.missing_params = [
+                param for param in step.params if param not in producers
+            ]
+            if unpredictable:
+                # maybe given by a previous task
+                continue
+            step.status = StepStatus.UNSATISFIED
+        return Plan(steps, duplicate_keys)
+
+    pending = list(steps)
+    progress = True
+    while progress:
+        progress = False
+        for step in list(pending):
+            if not all(param in producers for param in step.params):
+                continue
+            pending.remove(step)
+            progress = True
+            _resolve(step)
+
+    unpredictable = any(
+        step.status == StepStatus.EXECUTE and step.outputs is None for step in steps
+    )
+    for step in pending:
+        step.missing_params = [param for param in step.params if param not in producers]
+        if not unpredictable:
+            step.status = StepStatus.UNSATISFIED
+
+    return Plan(steps, duplicate_keys)
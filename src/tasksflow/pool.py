@@ -1,8 +1,12 @@
 from .task import Task
-from typing import Optional
-from .cache import CacheProvider, SqliteCacheProvider
-from .executer import Executer, MultiprocessExecuter
+from typing import Iterator, Optional
+from .cache import CachePolicy, CacheProvider, LazyPayload, SqliteCacheProvider
+from .executer import Executer, MultiprocessExecuter, SerialExecuter
+from .common import Code, Payload
+from .fingerprint import fingerprint
+from .plan import Plan, explain
 from copy import deepcopy
+import inspect
 
 
 class Pool:
@@ -11,6 +15,7 @@ class Pool:
         tasks: list[Task],
         cache_provider: Optional[CacheProvider] = None,
         executer: Optional[Executer] = None,
+        enable_snapshot: bool = False,
     ):
         """
         Pool of tasks
@@ -18,6 +23,8 @@ class Pool:
         :param tasks: list of tasks
         :param cache_provider: cache task execution result to avoid re-execution for the same input
         :param executer: execute the tasks in the pool
+        :param enable_snapshot: cache the final payload of the whole run, so an identical run
+            returns it with a single lookup
         """
 
         # use deepcopy to prevent tasks from being modified
@@ -36,9 +43,85 @@ class Pool:
             # executer = SerialExecuter(cache_provider=cache_provider)
             executer = MultiprocessExecuter(cache_provider=cache_provider)
         self.executer = executer
+        self.enable_snapshot = enable_snapshot
 
     def run(self):
         """
         Execute the tasks in the pool
         """
-        return self.executer.run(self.tasks)
+        if not self._snapshot_enabled():
+            return self.executer.run(self.tasks)
+
+        for _, d_payload in self.run_many([{}]):
+            return d_payload
+
+    def run_many(self, inputs_list: list[Payload]) -> Iterator[tuple[int, Payload]]:
+        """
+        Execute the tasks in the pool for each seed payload in inputs_list,
+        yield (index, result) as each instance finishes
+
+        :param inputs_list: list of seed payloads, given to the tasks as params
+        """
+        if not self._snapshot_enabled():
+            return self.executer.run_many(self.tasks, inputs_list)
+        return self._run_many_with_snapshots(inputs_list)
+
+    def _run_many_with_snapshots(
+        self, inputs_list: list[Payload]
+    ) -> Iterator[tuple[int, Payload]]:
+        cache_provider = self.executer.cache_provider
+        assert cache_provider is not None
+        code = self._get_snapshot_code()
+
+        # instances without snapshot, index in the run -> index in inputs_list
+        misses: list[int] = []
+        for i, payload in enumerate(inputs_list):
+            snapshot = cache_provider.get(code, payload)
+            if snapshot is None:
+                misses.append(i)
+            else:
+                yield i, LazyPayload.wrap(dict(snapshot))
+
+        if not misses:
+            return
+
+        # fall back to per-task caching
+        for j, d_payload in self.executer.run_many(
+            self.tasks, [inputs_list[i] for i in misses]
+        ):
+            # lazy values are stored without deserializing them
+            cache_provider.set(code, inputs_list[misses[j]], d_payload.copy())
+            yield misses[j], d_payload
+
+    def _snapshot_enabled(self) -> bool:
+        """
+        snapshots bypass the tasks, so all of them must use the cache normally
+        """
+        return (
+            self.enable_snapshot
+            and self.executer.cache_provider is not None
+            and all(task.cache_policy == CachePolicy.NORMAL for task in self.tasks)
+        )
+
+    def _get_snapshot_code(self) -> Code:
+        """
+        get the signature of the task graph, changed by the code, configuration or order of any task
+        """
+        signature = fingerprint(
+            [(inspect.getsource(task.__class__), vars(task)) for task in self.tasks]
+        )
+        return f"snapshot:{signature}"
+
+    def explain(self, payload: Optional[Payload] = None) -> Plan:
+        """
+        Resolve the tasks in the pool without running them, report predicted cache hits,
+        estimated duration, unsatisfied parameters and duplicate output keys
+
+        :param payload: seed params given to the tasks
+        """
+        return explain(
+            self.tasks,
+            self.executer.cache_provider,
+            payload,
+            serial=isinstance(self.executer, SerialExecuter),
+        )
@@ -0,0 +1,347 @@
+import concurrent.futures
+import concurrent.futures.process
+import itertools
+import threading
+import time
+import weakref
+from multiprocessing.connection import Connection
+from typing import Any, Callable, Optional
+from .common import estimate_size
+from .fingerprint import Fingerprinted, fingerprint
+
+# objects kept in this worker process, ref id -> value
+_objects: dict[int, Any] = {}
+_ids = itertools.count()
+# index of this worker process, -1 in the parent
+_worker = -1
+
+
+class Ref(Fingerprinted):
+    """
+    reference to a value kept in a worker process of WorkerPool
+    """
+
+    def __init__(self, worker: int, id: int, nbytes: int, digest: str):
+        """
+        :param worker: index of the worker holding the value
+        :param id: id of the value in the worker
+        :param nbytes: estimated size of the value, used for locality
+        :param digest: the fingerprint of the value
+        """
+        super().__init__(digest)
+        self.worker = worker
+        self.id = id
+        self.nbytes = nbytes
+
+    def __repr__(self):
+        return f"Ref(worker={self.worker}, id={self.id}, nbytes={self.nbytes})"
+
+
+def put(value: Any) -> Ref:
+    """
+    keep value in this worker process, return a reference to it
+
+    :param value: the value to keep
+    """
+    id = next(_ids)
+    _objects[id] = value
+    return Ref(_worker, id, estimate_size(value), fingerprint(value))
+
+
+def get(ref: Ref) -> Any:
+    """
+    get a value kept in this worker process
+
+    :param ref: the reference returned by put
+    """
+    if ref.worker != _worker:
+        raise ValueError(f"{ref} is not kept in worker {_worker}")
+    return _objects[ref.id]
+
+
+def _send_exception(send: Callable[[Any], None], call_id: int, e: Exception):
+    try:
+        send((call_id, False, e))
+    except Exception:
+        # the exception can not be pickled
+        send((call_id, False, RuntimeError(repr(e))))
+
+
+def _serve_fetches(conn: Connection, send: Callable[[Any], None]):
+    """
+    answer fetches and frees of the parent, even while a task is running
+    """
+    while True:
+        try:
+            call_id, free, ids = conn.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            if free:
+                for id in ids:
+                    _objects.pop(id, None)
+                send((call_id, True, None))
+            else:
+                send((call_id, True, [_objects[id] for id in ids]))
+        except Exception as e:
+            _send_exception(send, call_id, e)
+
+
+def _worker_main(
+    index: int,
+    tasks_conn: Connection,
+    fetch_conn: Connection,
+    results_conn: Connection,
+    initializer: Optional[Callable[..., None]],
+    initargs: tuple,
+):
+    global _worker
+    _worker = index
+    lock = threading.Lock()
+
+    def send(message: Any):
+        with lock:
+            results_conn.send(message)
+
+    threading.Thread(
+        target=_serve_fetches, args=(fetch_conn, send), daemon=True
+    ).start()
+    if initializer is not None:
+        initializer(*initargs)
+
+    while True:
+        try:
+            message = tasks_conn.recv()
+        except (EOFError, OSError):
+            return
+        if message is None:
+            return
+
+        call_id, fn, args = message
+        try:
+            result = fn(*args)
+        except Exception as e:
+            _send_exception(send, call_id, e)
+            continue
+        try:
+            send((call_id, True, result))
+        except Exception as e:
+            # e.g. the result can not be pickled
+            _send_exception(send, call_id, e)
+
+
+class _Worker:
+    def __init__(self, ctx, index: int, initializer, initargs: tuple):
+        tasks_reader, self.tasks_conn = ctx.Pipe(duplex=False)
+        fetch_reader, self.fetch_conn = ctx.Pipe(duplex=False)
+        self.results_conn, results_writer = ctx.Pipe(duplex=False)
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(
+                index,
+                tasks_reader,
+                fetch_reader,
+                results_writer,
+                initializer,
+                initargs,
+            ),
+            # tasks may start processes of their own, which daemonic processes can not
+            daemon=False,
+        )
+        self.process.start()
+        # the child holds its own copies
+        tasks_reader.close()
+        fetch_reader.close()
+        results_writer.close()
+
+        self.lock = threading.Lock()
+        self.pending: dict[int, concurrent.futures.Future] = {}
+        self.exited = False
+        self.reader = threading.Thread(target=self._read_results, daemon=True)
+        self.reader.start()
+
+    def _read_results(self):
+        while True:
+            try:
+                call_id, ok, value = self.results_conn.recv()
+            except Exception:
+                break
+            with self.lock:
+                future = self.pending.pop(call_id, None)
+            if future is None:
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+        # the worker exited, fail what it never answered
+        with self.lock:
+            self.exited = True
+            pending, self.pending = self.pending, {}
+        for future in pending.values():
+            future.set_exception(self._broken())
+
+    def _broken(self) -> Exception:
+        return concurrent.futures.process.BrokenProcessPool(
+            f"worker process {self.process.pid} exited"
+        )
+
+    def call(
+        self, conn: Connection, call_id: int, message: Any
+    ) -> concurrent.futures.Future:
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        # sent right away, so it can not be cancelled
+        future.set_running_or_notify_cancel()
+        with self.lock:
+            if self.exited:
+                future.set_exception(self._broken())
+                return future
+            self.pending[call_id] = future
+        try:
+            conn.send(message)
+        except Exception as e:
+            with self.lock:
+                self.pending.pop(call_id, None)
+            future.set_exception(e)
+        return future
+
+
+def _terminate(workers: list[Optional[_Worker]], timeout: float):
+    """
+    stop the started worker processes, kill those not exited after timeout seconds
+    """
+    started = [w for w in workers if w is not None]
+    for w in started:
+        if w.process.is_alive():
+            w.process.terminate()
+    deadline = time.monotonic() + timeout
+    for w in started:
+        w.process.join(max(deadline - time.monotonic(), 0))
+        if w.process.is_alive():
+            w.process.kill()
+            w.process.join()
+
+
+class WorkerPool:
+    """
+    WorkerPool is a process pool submitting calls to a chosen worker, started on its first call,
+    values kept in a worker by put can be fetched by the parent at any time
+    """
+
+    def __init__(
+        self,
+        max_workers: int,
+        mp_context,
+        initializer: Optional[Callable[..., None]] = None,
+        initargs: tuple = (),
+    ):
+        """
+        :param max_workers: the maximal number of worker processes
+        :param mp_context: the multiprocessing context to start workers with
+        :param initializer: called in each worker before any call
+        :param initargs: the arguments of initializer
+        """
+        self.call_ids = itertools.count()
+        self.mp_context = mp_context
+        self.initializer = initializer
+        self.initargs = initargs
+        # workers are started on their first call
+        self.workers: list[Optional[_Worker]] = [None] * max_workers
+        # workers not shut down are terminated once the pool is collected or at exit,
+        # instead of being waited for
+        self._finalizer = weakref.finalize(self, _terminate, self.workers, 0.0)
+
+    def _get_worker(self, worker: int) -> _Worker:
+        w = self.workers[worker]
+        if w is None:
+            w = _Worker(self.mp_context, worker, self.initializer, self.initargs)
+            self.workers[worker] = w
+        return w
+
+    def submit(self, worker: int, fn: Callable, *args) -> concurrent.futures.Future:
+        """
+        call fn(*args) in worker, calls in the same worker run one by one
+
+        :param worker: index of the worker, started if it is not yet
+        :param fn: a picklable callable
+        """
+        call_id = next(self.call_ids)
+        w = self._get_worker(worker)
+        return w.call(w.tasks_conn, call_id, (call_id, fn, args))
+
+    def fetch(self, refs: list[Ref]) -> list[Any]:
+        """
+        get the values of refs from the workers keeping them
+
+        :param refs: references returned by put in the workers
+        """
+        by_worker: dict[int, list[Ref]] = {}
+        for ref in refs:
+            by_worker.setdefault(ref.worker, []).append(ref)
+
+        futures = {}
+        for worker, worker_refs in by_worker.items():
+            call_id = next(self.call_ids)
+            w = self._get_worker(worker)
+            futures[worker] = w.call(
+                w.fetch_conn, call_id, (call_id, False, [ref.id for ref in worker_refs])
+            )
+
+        values: dict[tuple[int, int], Any] = {}
+        for worker, future in futures.items():
+            for ref, value in zip(by_worker[worker], future.result()):
+                values[(ref.worker, ref.id)] = value
+        return [values[(ref.worker, ref.id)] for ref in refs]
+
+    def free(self, refs: list[Ref]):
+        """
+        drop the values of refs from the workers keeping them, without waiting
+
+        :param refs: references returned by put in the workers, not fetched afterwards
+        """
+        by_worker: dict[int, list[int]] = {}
+        for ref in refs:
+            by_worker.setdefault(ref.worker, []).append(ref.id)
+        for worker, ids in by_worker.items():
+            call_id = next(self.call_ids)
+            w = self._get_worker(worker)
+            w.call(w.fetch_conn, call_id, (call_id, True, ids))
+
+    def terminate_workers(self, timeout: float = 5.0):
+        """
+        stop the worker processes without waiting for running calls,
+        their pending futures fail with BrokenProcessPool
+
+        :param timeout: seconds to wait for workers to exit before killing them
+        """
+        _terminate(self.workers, timeout)
+
+    def shutdown(self, wait: bool = True):
+        """
+        stop the worker processes after their running calls
+
+        :param wait: whether to wait for the workers to exit
+        """
+        started = [w for w in self.workers if w is not None]
+        for w in started:
+            try:
+                w.tasks_conn.send(None)
+            except OSError:
+                # the worker already exited
+                pass
+            w.tasks_conn.close()
+            w.fetch_conn.close()
+        if not wait:
+            return
+        self._finalizer.detach()
+        for w in started:
+            w.process.join()
+            w.reader.join()
+            w.results_conn.close()
+
+    def __enter__(self) -> "WorkerPool":
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown(wait=True)
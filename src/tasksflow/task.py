@@ -1,6 +1,6 @@
 from abc import ABC, abstractmethod
 from typing import Optional
-from .cache import CacheProvider
+from .cache import CacheProvider, CachePolicy
 from .common import Payload
 
 
@@ -15,14 +15,39 @@ def _is_payload_valid(payload: Payload) -> bool:
 
 
 class Task(ABC):
-    def __init__(self, enable_cache: bool = True):
+    # resources needed by one execution, e.g. {"cpus": 4, "memory": 2 * 1024**3, "gpu": 1},
+    # cpus default to 1, see MultiprocessExecuter capacity
+    resources: dict[str, float] = {}
+    # how the executer uses the cache for the task
+    cache_policy: CachePolicy = CachePolicy.NORMAL
+    # whether running the task twice is harmless, so stragglers may be speculated
+    idempotent: bool = False
+
+    def __init__(
+        self,
+        enable_cache: bool = True,
+        resources: Optional[dict[str, float]] = None,
+        cache_policy: Optional[CachePolicy] = None,
+        idempotent: Optional[bool] = None,
+    ):
         """
         Task is the base class for all tasks
 
-        :param enable_cache: whether to enable cache for the task
+        :param enable_cache: whether to enable cache for the task, False is the same as CachePolicy.OFF
+        :param resources: resources needed by one execution, override the class attribute
+        :param cache_policy: how the executer uses the cache for the task, override the class attribute
+        :param idempotent: whether running the task twice is harmless, override the class attribute
         """
         self.enable_cache = enable_cache
         self.cache_provider: Optional[CacheProvider] = None
+        if resources is not None:
+            self.resources = {**self.resources, **resources}
+        if cache_policy is not None:
+            self.cache_policy = cache_policy
+        elif not enable_cache:
+            self.cache_policy = CachePolicy.OFF
+        if idempotent is not None:
+            self.idempotent = idempotent
 
     @abstractmethod
     def run(self, *args, **kwargs) -> Optional[Payload]:
@@ -0,0 +1,123 @@
+from pathlib import Path
+import shutil
+import uuid
+import tasksflow.cache
+import tasksflow.executer
+import tasksflow.pool
+import tasksflow.task
+from tasksflow.cache import CacheAdmission, CachePolicy
+
+dir_runs = Path("cache_policy_runs")
+
+
+class Task1(tasksflow.task.Task):
+    def run(self):
+        # side effect, one file per execution
+        (dir_runs / uuid.uuid4().hex).touch()
+        return {"a": 1}
+
+
+def _count_runs(task: Task1, executer: tasksflow.executer.Executer) -> int:
+    shutil.rmtree(dir_runs, ignore_errors=True)
+    dir_runs.mkdir()
+    try:
+        p = tasksflow.pool.Pool([task], executer=executer)
+        assert p.run() == {"a": 1}
+        assert p.run() == {"a": 1}
+        return len(list(dir_runs.iterdir()))
+    finally:
+        shutil.rmtree(dir_runs)
+
+
+def test_cache_policies():
+    for executer_class in [
+        tasksflow.executer.SerialExecuter,
+        tasksflow.executer.MultiprocessExecuter,
+    ]:
+        for task, runs, cached in [
+            (Task1(), 1, True),
+            (Task1(enable_cache=False), 2, False),
+            (Task1(cache_policy=CachePolicy.READ_ONLY), 2, False),
+            (Task1(cache_policy=CachePolicy.WRITE_ONLY), 2, True),
+        ]:
+            cache_provider = tasksflow.cache.MemoryCacheProvider()
+            executer = executer_class(cache_provider=cache_provider)
+            assert _count_runs(task, executer) == runs
+            assert bool(cache_provider.d) == cached
+
+
+def test_cache_admission():
+    admission = CacheAdmission(cost_factor=2, size_limit=10)
+    assert admission.admit(0.0, 5, 1.0)
+    assert not admission.admit(1.0, 100, 1.0)
+    assert admission.admit(3.0, 100, 1.0)
+
+    admission.record_store(100_000, 1.0)
+    size, cost = admission.estimate({"a": "x" * 1000})
+    assert size > 1000
+    assert cost >= size * 1e-5
+
+
+def test_cache_admission_small_stores():
+    """
+    small stores measure the fixed overhead, not the cost per byte of large results
+    """
+    admission = CacheAdmission(cost_factor=2, size_limit=1024)
+    result = {"s": 1}
+    size, cost = admission.estimate(result)
+    admission.record_store(size, 1e-4)
+
+    size, cost = admission.estimate({"data": bytes(20 * 1024 * 1024)})
+    assert cost < 0.5
+    assert admission.admit(1.0, size, cost)
+
+    admission.record_store(size, 0.1)
+    _, small_cost = admission.estimate(result)
+    assert small_cost < 1e-3
+
+
+def test_cache_admission_rejects():
+    cache_provider = tasksflow.cache.MemoryCacheProvider()
+    executer = tasksflow.executer.SerialExecuter(
+        cache_provider=cache_provider,
+        cache_admission=CacheAdmission(cost_factor=1e9, size_limit=0),
+    )
+    assert _count_runs(Task1(), executer) == 2
+    assert not cache_provider.d
+
+
+def test_cache_admission_abandons_lease():
+    """
+    a result not admitted abandons the lease, other processes compute the task at once
+    """
+    db_path = Path("test_abandon.db")
+    cache_provider = tasksflow.cache.SqliteCacheProvider(db_path)
+    other = tasksflow.cache.SqliteCacheProvider(db_path)
+    try:
+        executer = tasksflow.executer.SerialExecuter(
+            cache_provider=cache_provider,
+            cache_admission=CacheAdmission(cost_factor=1e9, size_limit=0),
+        )
+        assert _count_runs(Task1(), executer) == 2
+
+        task_code = executer._get_task_key(Task1(), {})[0]
+        assert other.acquire(task_code, {})
+        assert cache_provider.acquire(task_code, {})
+    finally:
+        cache_provider.clear()
+
+
+def test_sqlite_abandon():
+    db_path = Path("test_abandon.db")
+    c1 = tasksflow.cache.SqliteCacheProvider(db_path)
+    c2 = tasksflow.cache.SqliteCacheProvider(db_path)
+    try:
+        assert c1.acquire("code", {"a": 1})
+        c2.abandon("code", {"a": 1})  # not the owner, no effect
+        assert not c2.acquire("code", {"a": 1})
+
+        c1.abandon("code", {"a": 1})
+        assert c2.acquire("code", {"a": 1})
+        assert c1.acquire("code", {"a": 1})
+    finally:
+        c1.clear()
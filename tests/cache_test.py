@@ -55,3 +55,25 @@ def test_cache_work():
 
     p.run()
     assert not file_tmp.exists()
+
+
+def test_provider_timings() -> None:
+    sqlite_cache_provider = tasksflow.cache.SqliteCacheProvider(Path("test.db"))
+
+    cache_providers: list[tasksflow.cache.CacheProvider] = [
+        sqlite_cache_provider,
+        tasksflow.cache.MemoryCacheProvider(),
+    ]
+
+    for c in cache_providers:
+        assert c.get_timings("tasktest") == []
+        for i in range(tasksflow.cache.TIMING_HISTORY + 1):
+            c.add_timing("tasktest", tasksflow.cache.Timing(i, ("a", "b")))
+
+        timings = c.get_timings("tasktest")
+        assert len(timings) == tasksflow.cache.TIMING_HISTORY
+        assert timings[-1] == tasksflow.cache.Timing(
+            tasksflow.cache.TIMING_HISTORY, ("a", "b")
+        )
+
+    sqlite_cache_provider.clear()
@@ -0,0 +1,107 @@
+import time
+import pytest
+import tasksflow.executer
+import tasksflow.pool
+import tasksflow.task
+from tasksflow.executer import ExecutionError, FailureMode
+
+
+class Task1(tasksflow.task.Task):
+    def run(self):
+        return {"a": 1}
+
+
+class TaskFail(tasksflow.task.Task):
+    def run(self, a: int):
+        time.sleep(0.5)
+        raise RuntimeError("task failed")
+
+
+class TaskAfterFail(tasksflow.task.Task):
+    def run(self, failed: int):
+        return {"after_failed": failed}
+
+
+class TaskSlow(tasksflow.task.Task):
+    def run(self, a: int):
+        time.sleep(2)
+        return {"slow": a}
+
+
+class TaskAfterSlow(tasksflow.task.Task):
+    def run(self, slow: int):
+        return {"after_slow": slow}
+
+
+tasks = [Task1(), TaskFail(), TaskAfterFail(), TaskSlow(), TaskAfterSlow()]
+
+
+def test_multiprocess_fail_fast():
+    p = tasksflow.pool.Pool(
+        tasks,
+        executer=tasksflow.executer.MultiprocessExecuter(max_workers=2),
+    )
+    start = time.time()
+    with pytest.raises(ExecutionError) as exc_info:
+        p.run()
+    assert time.time() - start < 2  # TaskSlow is terminated
+
+    e = exc_info.value
+    assert isinstance(e.__cause__, RuntimeError)
+    assert [task.__class__ for _, task, _ in e.errors] == [TaskFail]
+    assert e.payload == {"a": 1}
+    assert [task.__class__ for task in e.completed[0]] == [Task1]
+
+
+def test_multiprocess_keep_going():
+    p = tasksflow.pool.Pool(
+        tasks,
+        executer=tasksflow.executer.MultiprocessExecuter(
+            failure_mode=FailureMode.KEEP_GOING
+        ),
+    )
+    with pytest.raises(ExecutionError) as exc_info:
+        p.run()
+
+    e = exc_info.value
+    assert [task.__class__ for _, task, _ in e.errors] == [TaskFail]
+    assert e.payload == {"a": 1, "slow": 1, "after_slow": 1}
+
+
+def test_serial_failure_modes():
+    p = tasksflow.pool.Pool(tasks, executer=tasksflow.executer.SerialExecuter())
+    with pytest.raises(ExecutionError) as exc_info:
+        p.run()
+    assert exc_info.value.payload == {"a": 1}
+
+    p = tasksflow.pool.Pool(
+        tasks,
+        executer=tasksflow.executer.SerialExecuter(failure_mode=FailureMode.KEEP_GOING),
+    )
+    with pytest.raises(ExecutionError) as exc_info:
+        p.run()
+    assert exc_info.value.payload == {"a": 1, "slow": 1, "after_slow": 1}
+
+
+class TaskCheck(tasksflow.task.Task):
+    def run(self, x: int):
+        if x < 0:
+            raise ValueError("x must not be negative")
+        return {"y": x}
+
+
+def test_run_many_keep_going():
+    p = tasksflow.pool.Pool(
+        [TaskCheck()],
+        executer=tasksflow.executer.MultiprocessExecuter(
+            failure_mode=FailureMode.KEEP_GOING
+        ),
+    )
+    results = []
+    with pytest.raises(ExecutionError) as exc_info:
+        for i, result in p.run_many([{"x": 1}, {"x": -1}, {"x": 2}]):
+            results.append(i)
+
+    assert sorted(results) == [0, 2]
+    assert [i for i, _, _ in exc_info.value.errors] == [1]
+    assert exc_info.value.payload == {"x": -1}
@@ -0,0 +1,125 @@
+from pathlib import Path
+import os
+import subprocess
+import sys
+import threading
+import tasksflow.cache
+import tasksflow.fingerprint
+from tasksflow.fingerprint import fingerprint
+
+
+def test_fingerprint_stable():
+    assert fingerprint({"a": 1, "b": 2}) == fingerprint({"b": 2, "a": 1})
+    assert fingerprint({"s": {3, 1, 2}}) == fingerprint({"s": {2, 3, 1}})
+
+    assert fingerprint(1) != fingerprint(True)
+    assert fingerprint(1) != fingerprint("1")
+    assert fingerprint([1, 2]) != fingerprint((1, 2))
+    assert fingerprint(b"ab") != fingerprint(bytearray(b"ab"))
+    assert fingerprint(["ab", "c"]) != fingerprint(["a", "bc"])
+
+
+def test_fingerprint_buffer():
+    data = bytes(range(256)) * 10000
+    assert fingerprint(data) == fingerprint(bytes(data))
+    assert fingerprint(memoryview(data)[::2]) == fingerprint(memoryview(data[::2]))
+    assert fingerprint(data) != fingerprint(data[:-1] + b"\x00")
+
+
+def test_fingerprint_path():
+    path = Path("fingerprint_test.tmp")
+    path.write_text("1")
+    try:
+        before = fingerprint(path)
+        assert before == fingerprint(Path("fingerprint_test.tmp"))
+
+        path.write_text("12")
+        assert fingerprint(path) != before
+    finally:
+        path.unlink()
+
+
+class Handle:
+    """
+    an unpicklable object that identifies itself by name
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.lock = threading.Lock()
+
+    def __tasksflow_fingerprint__(self):
+        return self.name
+
+
+class Point:
+    def __init__(self, x: int, y: int):
+        self.x = x
+        self.y = y
+
+
+def test_fingerprint_hook_and_register():
+    assert fingerprint(Handle("a")) == fingerprint(Handle("a"))
+    assert fingerprint(Handle("a")) != fingerprint(Handle("b"))
+
+    tasksflow.fingerprint.register(
+        Point, lambda p, hasher: tasksflow.fingerprint.update(hasher, (p.x, p.y))
+    )
+    assert fingerprint(Point(1, 2)) == fingerprint(Point(1, 2))
+    assert fingerprint(Point(1, 2)) != fingerprint(Point(2, 1))
+
+
+def test_cache_with_unpicklable_params():
+    c = tasksflow.cache.MemoryCacheProvider()
+    c.set("code", {"h": Handle("a")}, {"r": 1})
+    assert c.get("code", {"h": Handle("a")}) == {"r": 1}
+    assert c.get("code", {"h": Handle("b")}) is None
+
+
+def test_stable_fingerprint():
+    stable_fingerprint = tasksflow.fingerprint.stable_fingerprint
+    assert stable_fingerprint({"a": [1, "x"]}) == fingerprint({"a": [1, "x"]})
+    assert stable_fingerprint(Path("a")) is None
+    assert stable_fingerprint({"files": [Path("a")]}) is None
+    assert stable_fingerprint({"files": []}) is not None
+
+
+_OBJECT_SCRIPT = """
+from dataclasses import dataclass
+from tasksflow.fingerprint import fingerprint
+
+@dataclass
+class Config:
+    names: set
+
+print(fingerprint(Config({"alpha", "beta", "gamma", "delta"})))
+"""
+
+
+def test_fingerprint_objects_across_processes():
+    """
+    plain objects are fingerprinted by their state, not by their pickle,
+    which depends on the set order of each process
+    """
+    digests = {
+        subprocess.run(
+            [sys.executable, "-c", _OBJECT_SCRIPT],
+            env={**os.environ, "PYTHONHASHSEED": str(seed)},
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        for seed in range(1, 5)
+    }
+    assert len(digests) == 1
+
+
+class Node:
+    def __init__(self, value: int):
+        self.value = value
+        self.parent = self
+
+
+def test_fingerprint_object_cycle():
+    assert fingerprint(Node(1)) == fingerprint(Node(1))
+    assert fingerprint(Node(1)) != fingerprint(Node(2))
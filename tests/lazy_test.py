@@ -0,0 +1,151 @@
+from pathlib import Path
+import json
+import pickle
+import sqlite3
+import tasksflow.cache
+import tasksflow.executer
+import tasksflow.fingerprint
+import tasksflow.pool
+import tasksflow.task
+from tasksflow.cache import CachePolicy, LazyPayload, LazyValue
+
+# deserializations of Blob in this process
+loads: list[int] = []
+
+
+class Blob:
+    def __init__(self, size: int):
+        self.data = bytes(size)
+
+    def __setstate__(self, state):
+        loads.append(len(state["data"]))
+        self.__dict__.update(state)
+
+
+class TaskFetch(tasksflow.task.Task):
+    def run(self):
+        return {"resp": Blob(1024), "meta": {"size": 1024}}
+
+
+class TaskParse(tasksflow.task.Task):
+    def run(self, meta: dict):
+        return {"size": meta["size"]}
+
+
+def test_lazy_cache_hits():
+    db_path = Path("lazy_test.db")
+    db_path.unlink(missing_ok=True)
+    try:
+        cache_provider = tasksflow.cache.SqliteCacheProvider(db_path)
+        for executer in [
+            tasksflow.executer.SerialExecuter(cache_provider=cache_provider),
+            tasksflow.executer.MultiprocessExecuter(cache_provider=cache_provider),
+        ]:
+            for parse in [TaskParse(), TaskParse(cache_policy=CachePolicy.WRITE_ONLY)]:
+                p = tasksflow.pool.Pool([TaskFetch(), parse], executer=executer)
+                p.run()
+
+                loads.clear()
+                result = p.run()
+                assert isinstance(result, LazyPayload)
+                # resp is read by no task
+                assert result["size"] == 1024
+                assert loads == []
+
+                assert result["resp"].data == bytes(1024)
+                assert loads == [1024]
+                assert dict(result)["meta"] == {"size": 1024}
+    finally:
+        db_path.unlink(missing_ok=True)
+
+
+def test_lazy_payload():
+    value = LazyValue(None, pickle.dumps([1, 2]))
+    payload = LazyPayload.wrap({"a": value, "b": 3})
+    assert payload == {"a": [1, 2], "b": 3}
+    assert dict(payload) == {"a": [1, 2], "b": 3}
+    assert {**payload}["a"] == [1, 2]
+    assert payload.copy() == payload
+    assert value.digest == tasksflow.fingerprint.fingerprint([1, 2])
+
+    plain = {"b": 3}
+    assert LazyPayload.wrap(plain) is plain
+
+    payload = LazyPayload.wrap({"b": 3, "a": LazyValue(None, pickle.dumps([1, 2]))})
+    # lazy values are never handed out
+    assert type(payload.setdefault("a", None)) is list
+    assert payload.setdefault("c", 4) == 4
+    payload = LazyPayload.wrap({"b": 3, "a": LazyValue(None, pickle.dumps([1, 2]))})
+    key, value = payload.popitem()
+    assert key == "a" and type(value) is list
+
+
+def test_legacy_records():
+    db_path = Path("lazy_legacy_test.db")
+    db_path.unlink(missing_ok=True)
+    try:
+        cache_provider = tasksflow.cache.SqliteCacheProvider(db_path)
+        cache_provider.set("task", {"a": 1}, {"b": 2})
+        # a whole pickled result, as written by older versions
+        with sqlite3.connect(db_path) as conn:
+            conn.execute("UPDATE cache SET result = ?", (pickle.dumps({"b": 3}),))
+        assert cache_provider.get("task", {"a": 1}) == {"b": 3}
+
+        cache_provider.set("task", {"a": 2}, {"b": 4})
+        cache_provider.clear(remain_records=1)
+        # values of removed records are removed too
+        with sqlite3.connect(db_path) as conn:
+            assert conn.execute("SELECT COUNT(*) FROM cache").fetchone() == (1,)
+            assert conn.execute("SELECT COUNT(*) FROM cache_value").fetchone() == (1,)
+    finally:
+        db_path.unlink(missing_ok=True)
+
+
+def test_lazy_values_outlive_record():
+    """
+    the values are read at the hit, clearing or rewriting the record later does not change them
+    """
+    db_path = Path("lazy_test.db")
+    db_path.unlink(missing_ok=True)
+    try:
+        cache_provider = tasksflow.cache.SqliteCacheProvider(db_path)
+        cache_provider.set("task", {"a": 1}, {"b": [1, 2]})
+        first = cache_provider.get("task", {"a": 1})
+        second = cache_provider.get("task", {"a": 1})
+        assert first is not None and second is not None
+
+        cache_provider.set("task", {"a": 1}, {"b": [3]})
+        assert first["b"].get() == [1, 2]
+        assert first["b"].digest == tasksflow.fingerprint.fingerprint([1, 2])
+
+        cache_provider.clear()
+        assert second["b"].get() == [1, 2]
+    finally:
+        db_path.unlink(missing_ok=True)
+
+
+def test_nested_path_digest():
+    """
+    a value holding paths at any depth is fingerprinted again when read, as the files may change
+    """
+    db_path = Path("lazy_test.db")
+    file_path = Path("lazy_test.txt")
+    db_path.unlink(missing_ok=True)
+    try:
+        file_path.write_text("1")
+        cache_provider = tasksflow.cache.SqliteCacheProvider(db_path)
+        cache_provider.set("task", {"a": 1}, {"out": {"files": [file_path]}, "n": 1})
+        with sqlite3.connect(db_path) as conn:
+            index = conn.execute("SELECT result FROM cache").fetchone()[0]
+        assert json.loads(index)["out"] is None
+        assert json.loads(index)["n"] is not None
+
+        file_path.write_text("22")
+        result = cache_provider.get("task", {"a": 1})
+        assert result is not None
+        assert result["out"].digest == tasksflow.fingerprint.fingerprint(
+            {"files": [file_path]}
+        )
+    finally:
+        db_path.unlink(missing_ok=True)
+        file_path.unlink(missing_ok=True)
@@ -0,0 +1,93 @@
+from pathlib import Path
+import tasksflow.cache
+import tasksflow.executer
+import tasksflow.metrics
+import tasksflow.pool
+import tasksflow.task
+
+
+class Task1(tasksflow.task.Task):
+    def run(self):
+        return {"a": 1, "b": 2}
+
+
+class Task2(tasksflow.task.Task):
+    def run(self, a: int, b: int):
+        return {"c": a + b}
+
+
+def test_prometheus_format():
+    registry = tasksflow.metrics.MetricsRegistry(enabled=True)
+    counter = registry.counter("test_total", "Test counter.", ("kind",))
+    histogram = registry.histogram("test_seconds", "Test histogram.", buckets=(1, 2))
+
+    counter.inc(kind='a"b')
+    counter.inc(2, kind='a"b')
+    histogram.observe(1.5)
+    histogram.observe(3)
+
+    assert counter.value(kind='a"b') == 3
+    assert histogram.count() == 2
+    assert histogram.sum() == 4.5
+    assert registry.to_prometheus() == "\n".join(
+        [
+            "# HELP test_total Test counter.",
+            "# TYPE test_total counter",
+            'test_total{kind="a\\"b"} 3',
+            "# HELP test_seconds Test histogram.",
+            "# TYPE test_seconds histogram",
+            'test_seconds_bucket{le="1"} 0',
+            'test_seconds_bucket{le="2"} 1',
+            'test_seconds_bucket{le="+Inf"} 2',
+            "test_seconds_sum 4.5",
+            "test_seconds_count 2",
+            "",
+        ]
+    )
+
+
+def test_disabled():
+    registry = tasksflow.metrics.MetricsRegistry()
+    counter = registry.counter("test_total", "Test counter.")
+    counter.inc()
+    assert counter.value() == 0
+
+
+def test_executer_metrics():
+    registry = tasksflow.metrics.REGISTRY
+    registry.clear()
+    tasksflow.metrics.enable()
+    try:
+        cache_provider = tasksflow.cache.SqliteCacheProvider(Path("test_metrics.db"))
+        for executer in [
+            tasksflow.executer.SerialExecuter(cache_provider=cache_provider),
+            tasksflow.executer.MultiprocessExecuter(cache_provider=cache_provider),
+        ]:
+            p = tasksflow.pool.Pool([Task1(), Task2()], executer=executer)
+            assert p.run() == {"a": 1, "b": 2, "c": 3}
+        cache_provider.clear()
+
+        provider = "SqliteCacheProvider"
+        # a miss is looked up again after acquiring the lease
+        assert (
+            tasksflow.metrics.CACHE_LOOKUPS.value(provider=provider, result="miss") == 4
+        )
+        assert (
+            tasksflow.metrics.CACHE_LOOKUPS.value(provider=provider, result="hit") == 2
+        )
+        assert tasksflow.metrics.CACHE_LOOKUP_SECONDS.count(provider=provider) == 6
+        assert tasksflow.metrics.CACHE_WRITES.value(provider=provider) == 2
+        assert tasksflow.metrics.CACHE_WRITTEN_BYTES.value(provider=provider) > 0
+        assert tasksflow.metrics.CACHE_READ_BYTES.value(provider=provider) > 0
+        assert tasksflow.metrics.TASKS_EXECUTED.value(task="Task1") == 1
+        assert tasksflow.metrics.TASK_DURATION_SECONDS.count(task="Task2") == 1
+        assert tasksflow.metrics.BUSY_WORKERS.value() == 0
+
+        path = Path("test_metrics.prom")
+        registry.dump(path)
+        text = path.read_text()
+        path.unlink()
+        assert 'tasksflow_tasks_executed_total{task="Task1"} 1' in text
+    finally:
+        tasksflow.metrics.disable()
+        registry.clear()
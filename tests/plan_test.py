@@ -0,0 +1,155 @@
+import inspect
+from pathlib import Path
+import tasksflow.cache
+import tasksflow.executer
+import tasksflow.metrics
+import tasksflow.pool
+import tasksflow.task
+from tasksflow.cache import Timing
+from tasksflow.plan import StepStatus
+
+
+class Task1(tasksflow.task.Task):
+    def run(self):
+        return {"a": 1, "b": 2}
+
+
+class Task2(tasksflow.task.Task):
+    def run(self, a: int, b: int):
+        return {"c": a + b}
+
+
+class Task3(tasksflow.task.Task):
+    def run(self, c: int):
+        return {"d": c + 1}
+
+
+class Task5(tasksflow.task.Task):
+    def run(self, un_given: int):
+        pass
+
+
+def _statuses(plan) -> list[StepStatus]:
+    return [step.status for step in plan.steps]
+
+
+def test_explain_without_history():
+    p = tasksflow.pool.Pool(
+        [Task1(), Task2()], cache_provider=tasksflow.cache.MemoryCacheProvider()
+    )
+    plan = p.explain()
+    assert _statuses(plan) == [StepStatus.EXECUTE, StepStatus.UNKNOWN]
+    assert plan.has_unknown_durations
+    assert plan.is_valid() is None
+
+    p.tasks = [Task1(), Task5()]
+    plan = p.explain()
+    assert _statuses(plan) == [StepStatus.EXECUTE, StepStatus.UNKNOWN]
+    assert plan.steps[1].missing_params == ["un_given"]
+    assert plan.is_valid() is None
+
+
+def test_explain_cached():
+    tasks = [Task1(), Task2(), Task5()]
+    p = tasksflow.pool.Pool(
+        tasks[:2], cache_provider=tasksflow.cache.MemoryCacheProvider()
+    )
+    p.run()
+
+    p.tasks = tasks
+    plan = p.explain()
+    assert _statuses(plan) == [
+        StepStatus.CACHED,
+        StepStatus.CACHED,
+        StepStatus.UNSATISFIED,
+    ]
+    assert plan.steps[2].missing_params == ["un_given"]
+    assert plan.is_valid() is False
+    assert "missing: un_given" in str(plan)
+
+
+def test_explain_reads_no_values():
+    """
+    explain finds cached results and the tasks using them by the index, without lookups
+    """
+    db_path = Path("test_explain.db")
+    db_path.unlink(missing_ok=True)
+    cache_provider = tasksflow.cache.SqliteCacheProvider(db_path)
+    try:
+        p = tasksflow.pool.Pool(
+            [Task1(), Task2(), Task3()], cache_provider=cache_provider
+        )
+        p.run()
+
+        tasksflow.metrics.REGISTRY.clear()
+        tasksflow.metrics.enable()
+        try:
+            plan = p.explain()
+        finally:
+            tasksflow.metrics.disable()
+        assert _statuses(plan) == [StepStatus.CACHED] * 3
+        assert plan.steps[2].outputs == ("d",)
+        assert not tasksflow.metrics.CACHE_LOOKUPS.values
+        assert not tasksflow.metrics.CACHE_READ_BYTES.values
+    finally:
+        db_path.unlink(missing_ok=True)
+
+
+def test_explain_estimation():
+    cache_provider = tasksflow.cache.MemoryCacheProvider()
+    for task, durations, keys in [
+        (Task1, [1.0, 5.0, 2.0], ("a", "b")),
+        (Task2, [3.0], ("c",)),
+        (Task3, [0.5, 0.5], ("d",)),
+    ]:
+        for duration in durations:
+            cache_provider.add_timing(inspect.getsource(task), Timing(duration, keys))
+
+    p = tasksflow.pool.Pool(
+        [Task1(), Task2(), Task3()],
+        executer=tasksflow.executer.SerialExecuter(cache_provider=cache_provider),
+    )
+    plan = p.explain()
+    assert _statuses(plan) == [StepStatus.EXECUTE] * 3
+    assert [step.estimated_duration for step in plan.steps] == [2.0, 3.0, 0.5]
+    assert plan.estimated_duration == 5.5
+    assert [step.name for step in plan.critical_path] == ["Task1", "Task2", "Task3"]
+    assert plan.is_valid()
+
+    plan = p.explain({"c": 0})
+    assert plan.duplicate_keys == {"c": ["payload", "Task2"]}
+    assert plan.is_valid() is False
+
+
+def test_explain_serial_order():
+    cache_provider = tasksflow.cache.MemoryCacheProvider()
+    cache_provider.add_timing(inspect.getsource(Task1), Timing(1.0, ("a", "b")))
+    cache_provider.add_timing(inspect.getsource(Task2), Timing(1.0, ("c",)))
+    tasks = [Task2(), Task1()]
+
+    # Task2 runs first in list order, before Task1 gives its params
+    p = tasksflow.pool.Pool(
+        tasks,
+        executer=tasksflow.executer.SerialExecuter(cache_provider=cache_provider),
+    )
+    plan = p.explain()
+    assert _statuses(plan) == [StepStatus.UNSATISFIED, StepStatus.EXECUTE]
+    assert plan.steps[0].missing_params == ["a", "b"]
+    assert plan.is_valid() is False
+
+    p = tasksflow.pool.Pool(
+        tasks,
+        executer=tasksflow.executer.MultiprocessExecuter(cache_provider=cache_provider),
+    )
+    plan = p.explain()
+    assert _statuses(plan) == [StepStatus.EXECUTE, StepStatus.EXECUTE]
+    assert plan.is_valid()
+
+
+def test_timings_recorded():
+    cache_provider = tasksflow.cache.MemoryCacheProvider()
+    p = tasksflow.pool.Pool([Task1(), Task2()], cache_provider=cache_provider)
+    p.run()
+    timings = cache_provider.get_timings(inspect.getsource(Task2))
+    assert len(timings) == 1
+    assert timings[0].keys == ("c",)
@@ -0,0 +1,62 @@
+import time
+import tasksflow.executer
+import tasksflow.pool
+import tasksflow.task
+
+
+class TaskHeavy1(tasksflow.task.Task):
+    resources = {"memory": 6}
+
+    def run(self):
+        start = time.time()
+        time.sleep(0.5)
+        return {"heavy1": (start, time.time())}
+
+
+class TaskHeavy2(tasksflow.task.Task):
+    resources = {"memory": 6}
+
+    def run(self):
+        start = time.time()
+        time.sleep(0.5)
+        return {"heavy2": (start, time.time())}
+
+
+class TaskLight(tasksflow.task.Task):
+    def run(self):
+        start = time.time()
+        time.sleep(0.5)
+        return {"light": (start, time.time())}
+
+
+def _overlap(a: tuple[float, float], b: tuple[float, float]) -> bool:
+    return a[0] < b[1] and b[0] < a[1]
+
+
+def test_memory_capacity():
+    p = tasksflow.pool.Pool(
+        [TaskHeavy1(), TaskHeavy2(), TaskLight(resources={"memory": 1})],
+        executer=tasksflow.executer.MultiprocessExecuter(
+            max_workers=3, capacity={"memory": 10}
+        ),
+    )
+    result = p.run()
+    assert not _overlap(result["heavy1"], result["heavy2"])
+    # the light task is packed around a heavy one
+    assert _overlap(result["light"], result["heavy1"]) or _overlap(
+        result["light"], result["heavy2"]
+    )
+
+
+def test_cpus_capacity():
+    p = tasksflow.pool.Pool(
+        [TaskLight(resources={"cpus": 8}), TaskHeavy1(), TaskHeavy2()],
+        executer=tasksflow.executer.MultiprocessExecuter(
+            max_workers=3, capacity={"cpus": 2}
+        ),
+    )
+    result = p.run()
+    # the task needing more than the capacity runs alone
+    assert not _overlap(result["light"], result["heavy1"])
+    assert not _overlap(result["light"], result["heavy2"])
+    assert _overlap(result["heavy1"], result["heavy2"])
@@ -0,0 +1,94 @@
+from pathlib import Path
+import gc
+import shutil
+import uuid
+import weakref
+import tasksflow.executer
+import tasksflow.pool
+import tasksflow.task
+
+dir_runs = Path("run_many_runs")
+
+
+class TaskShared(tasksflow.task.Task):
+    def run(self, base: int):
+        # side effect, one file per execution
+        (dir_runs / uuid.uuid4().hex).touch()
+        return {"a": base * 10}
+
+
+class TaskAdd(tasksflow.task.Task):
+    def run(self, a: int, x: int):
+        return {"b": a + x}
+
+
+def _run_many(executer: tasksflow.executer.Executer):
+    shutil.rmtree(dir_runs, ignore_errors=True)
+    dir_runs.mkdir()
+    try:
+        p = tasksflow.pool.Pool([TaskShared(), TaskAdd()], executer=executer)
+        inputs_list = [{"base": 1, "x": x} for x in range(5)] + [{"base": 2, "x": 0}]
+        results = dict(p.run_many(inputs_list))
+
+        assert sorted(results) == list(range(6))
+        for i, inputs in enumerate(inputs_list):
+            a = inputs["base"] * 10
+            assert results[i] == {**inputs, "a": a, "b": a + inputs["x"]}
+
+        # TaskShared is executed once per distinct base
+        assert len(list(dir_runs.iterdir())) == 2
+    finally:
+        shutil.rmtree(dir_runs)
+
+
+def test_serial_run_many():
+    _run_many(tasksflow.executer.SerialExecuter())
+
+
+def test_multiprocess_run_many():
+    _run_many(tasksflow.executer.MultiprocessExecuter())
+
+
+def test_run_many_unsatisfied():
+    p = tasksflow.pool.Pool(
+        [TaskAdd()], executer=tasksflow.executer.MultiprocessExecuter()
+    )
+    results = []
+    try:
+        for i, result in p.run_many([{"a": 1, "x": 1}, {"a": 1}]):
+            results.append(i)
+        raise Exception("Should raise an exception when x not given")
+    except ValueError:
+        pass
+    assert results == [0]
+
+
+class Value:
+    def __init__(self, x: int):
+        self.x = x
+
+
+class TaskValue(tasksflow.task.Task):
+    def run(self, x: int):
+        return {"value": Value(x)}
+
+
+def _check_yielded_dropped(executer: tasksflow.executer.Executer):
+    """
+    the executer keeps nothing of an instance once it is yielded,
+    and no later instance can be the same invocation
+    """
+    p = tasksflow.pool.Pool([TaskValue()], executer=executer)
+    results = p.run_many([{"x": x} for x in range(3)])
+    i, result = next(results)
+    value = weakref.ref(result["value"])
+    del result
+
+    next(results)
+    gc.collect()
+    assert value() is None
+    results.close()
+
+
+def test_multiprocess_run_many_drops_yielded():
+    _check_yielded_dropped(tasksflow.executer.MultiprocessExecuter(max_workers=2))
@@ -0,0 +1,149 @@
+from pathlib import Path
+import shutil
+import threading
+import time
+import uuid
+import tasksflow.cache
+import tasksflow.executer
+import tasksflow.pool
+import tasksflow.task
+
+dir_runs = Path("single_flight_runs")
+
+
+class Task1(tasksflow.task.Task):
+    def run(self):
+        return {"a": 1}
+
+
+class TaskCount(tasksflow.task.Task):
+    def run(self, a: int):
+        # side effect, one file per execution
+        (dir_runs / uuid.uuid4().hex).touch()
+        return {"b": a + 1}
+
+
+class Seed(tasksflow.task.Task):
+    def run(self):
+        return {"x": 3}
+
+
+class Mul(tasksflow.task.Task):
+    def __init__(self, k: int, out: str):
+        super().__init__(cache_policy=tasksflow.cache.CachePolicy.OFF)
+        self.k = k
+        self.out = out
+
+    def run(self, x: int):
+        return {self.out: x * self.k}
+
+
+def _count_runs(executer: tasksflow.executer.Executer) -> int:
+    shutil.rmtree(dir_runs, ignore_errors=True)
+    dir_runs.mkdir()
+    try:
+        p = tasksflow.pool.Pool([Task1(), TaskCount(), TaskCount()], executer=executer)
+        assert p.run() == {"a": 1, "b": 2}
+        return len(list(dir_runs.iterdir()))
+    finally:
+        shutil.rmtree(dir_runs)
+
+
+def test_serial_single_flight():
+    assert _count_runs(tasksflow.executer.SerialExecuter()) == 1
+
+
+def test_multiprocess_single_flight():
+    assert _count_runs(tasksflow.executer.MultiprocessExecuter()) == 1
+
+
+def test_serial_configured_instances():
+    """
+    instances of one class configured differently are different invocations
+    """
+    p = tasksflow.pool.Pool(
+        [Seed(), Mul(2, "y"), Mul(5, "z")],
+        executer=tasksflow.executer.SerialExecuter(),
+    )
+    assert p.run() == {"x": 3, "y": 6, "z": 15}
+
+
+def test_multiprocess_configured_instances():
+    p = tasksflow.pool.Pool(
+        [Seed(), Mul(2, "y"), Mul(5, "z")],
+        executer=tasksflow.executer.MultiprocessExecuter(),
+    )
+    assert p.run() == {"x": 3, "y": 6, "z": 15}
+
+
+def test_sqlite_lease():
+    db_path = Path("test_lease.db")
+    c1 = tasksflow.cache.SqliteCacheProvider(db_path)
+    c2 = tasksflow.cache.SqliteCacheProvider(db_path)
+    try:
+        assert c1.acquire("code", {"a": 1})
+        assert not c2.acquire("code", {"a": 1})
+        assert c2.acquire("code", {"a": 2})
+
+        c2.release("code", {"a": 1})  # not the owner, no effect
+        assert not c2.acquire("code", {"a": 1})
+
+        c1.release("code", {"a": 1})
+        assert c2.acquire("code", {"a": 1})
+    finally:
+        c1.clear()
+
+
+def test_sqlite_lease_expire():
+    db_path = Path("test_lease.db")
+    c1 = tasksflow.cache.SqliteCacheProvider(db_path, lease_timeout=0)
+    c2 = tasksflow.cache.SqliteCacheProvider(db_path)
+    try:
+        assert c1.acquire("code", {"a": 1})
+        assert c2.acquire("code", {"a": 1})
+    finally:
+        c1.clear()
+
+
+def test_sqlite_lease_renew():
+    db_path = Path("test_lease.db")
+    c1 = tasksflow.cache.SqliteCacheProvider(db_path, lease_timeout=0.5)
+    c2 = tasksflow.cache.SqliteCacheProvider(db_path)
+    try:
+        assert c1.acquire("code", {"a": 1})
+        time.sleep(0.3)
+        c1.renew("code", {"a": 1})
+        time.sleep(0.3)
+        # expired without the renewal
+        assert not c2.acquire("code", {"a": 1})
+        time.sleep(0.3)
+        assert c2.acquire("code", {"a": 1})
+    finally:
+        c1.clear()
+
+
+def test_wait_for_other_process():
+    """
+    the executer waits for the lease holder and uses its result instead of recomputing
+    """
+    db_path = Path("test_lease.db")
+    other = tasksflow.cache.SqliteCacheProvider(db_path)
+    cache_provider = tasksflow.cache.SqliteCacheProvider(db_path)
+    try:
+        executer = tasksflow.executer.MultiprocessExecuter(
+            cache_provider=cache_provider, lease_poll_interval=0.1
+        )
+        task_code = executer._get_task_key(TaskCount(), {"a": 1})[0]
+        assert other.acquire(task_code, {"a": 1})
+
+        def _finish_other():
+            other.set(task_code, {"a": 1}, {"b": 100})
+            other.release(task_code, {"a": 1})
+
+        timer = threading.Timer(0.5, _finish_other)
+        timer.start()
+        p = tasksflow.pool.Pool([Task1(), TaskCount()], executer=executer)
+        assert p.run() == {"a": 1, "b": 100}
+        timer.join()
+    finally:
+        cache_provider.clear()
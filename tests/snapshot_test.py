@@ -0,0 +1,82 @@
+from pathlib import Path
+import shutil
+import uuid
+import tasksflow.cache
+import tasksflow.executer
+import tasksflow.pool
+import tasksflow.task
+from tasksflow.cache import CachePolicy
+
+dir_runs = Path("snapshot_runs")
+
+
+class Task1(tasksflow.task.Task):
+    def run(self, a: int):
+        (dir_runs / uuid.uuid4().hex).touch()
+        return {"b": a + 1}
+
+
+class Task2(tasksflow.task.Task):
+    def run(self, b: int):
+        (dir_runs / uuid.uuid4().hex).touch()
+        return {"c": b * 2}
+
+
+class RecordingCacheProvider(tasksflow.cache.MemoryCacheProvider):
+    def __init__(self):
+        super().__init__()
+        self.lookups: list[str] = []
+
+    def get(self, code, params):
+        self.lookups.append(code)
+        return super().get(code, params)
+
+
+def test_snapshot():
+    shutil.rmtree(dir_runs, ignore_errors=True)
+    dir_runs.mkdir()
+    try:
+        cache_provider = RecordingCacheProvider()
+        executer = tasksflow.executer.SerialExecuter(cache_provider=cache_provider)
+
+        def make_pool(tasks):
+            return tasksflow.pool.Pool(tasks, executer=executer, enable_snapshot=True)
+
+        p = make_pool([Task1(), Task2()])
+        assert dict(p.run_many([{"a": 1}])) == {0: {"a": 1, "b": 2, "c": 4}}
+        assert len(list(dir_runs.iterdir())) == 2
+
+        # a single lookup for an identical run
+        cache_provider.lookups.clear()
+        assert dict(p.run_many([{"a": 1}, {"a": 2}])) == {
+            0: {"a": 1, "b": 2, "c": 4},
+            1: {"a": 2, "b": 3, "c": 6},
+        }
+        # one snapshot lookup per instance, per-task lookups only for the new one
+        assert cache_provider.lookups[0].startswith("snapshot:")
+        assert cache_provider.lookups[1].startswith("snapshot:")
+        assert len(list(dir_runs.iterdir())) == 4
+
+        # a changed task falls back to per-task caching
+        p = make_pool([Task1(resources={"cpus": 2}), Task2()])
+        assert dict(p.run_many([{"a": 1}])) == {0: {"a": 1, "b": 2, "c": 4}}
+        assert len(list(dir_runs.iterdir())) == 4
+
+        # no snapshot when a task does not use the cache normally
+        p = make_pool([Task1(), Task2(cache_policy=CachePolicy.WRITE_ONLY)])
+        assert not p._snapshot_enabled()
+        assert dict(p.run_many([{"a": 1}])) == {0: {"a": 1, "b": 2, "c": 4}}
+        assert len(list(dir_runs.iterdir())) == 5
+    finally:
+        shutil.rmtree(dir_runs)
+
+
+def test_snapshot_run():
+    cache_provider = tasksflow.cache.MemoryCacheProvider()
+    p = tasksflow.pool.Pool(
+        [Task2()],
+        executer=tasksflow.executer.MultiprocessExecuter(cache_provider=cache_provider),
+        enable_snapshot=True,
+    )
+    cache_provider.set(p._get_snapshot_code(), {}, {"c": 0})
+    assert p.run() == {"c": 0}
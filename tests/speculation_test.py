@@ -0,0 +1,56 @@
+from pathlib import Path
+import inspect
+import time
+import tasksflow.cache
+import tasksflow.executer
+import tasksflow.pool
+import tasksflow.task
+from tasksflow.cache import Timing
+
+file_straggler = Path("speculation_straggler")
+
+
+class TaskStraggler(tasksflow.task.Task):
+    idempotent = True
+
+    def run(self, a: int):
+        try:
+            # only the first execution is slow, e.g. on a bad node
+            file_straggler.open("x").close()
+            time.sleep(5)
+        except FileExistsError:
+            time.sleep(0.2)
+        return {"b": a + 1}
+
+
+def _run(task: TaskStraggler, speculation_factor) -> float:
+    file_straggler.unlink(missing_ok=True)
+    cache_provider = tasksflow.cache.MemoryCacheProvider()
+    code = inspect.getsource(TaskStraggler)
+    for _ in range(3):
+        cache_provider.add_timing(code, Timing(0.2, ("b",)))
+
+    p = tasksflow.pool.Pool(
+        [task],
+        executer=tasksflow.executer.MultiprocessExecuter(
+            cache_provider=cache_provider,
+            max_workers=2,
+            speculation_factor=speculation_factor,
+        ),
+    )
+    start = time.time()
+    try:
+        assert dict(p.run_many([{"a": 1}])) == {0: {"a": 1, "b": 2}}
+    finally:
+        file_straggler.unlink(missing_ok=True)
+    return time.time() - start
+
+
+def test_speculation():
+    assert _run(TaskStraggler(), 3) < 4
+
+
+def test_no_speculation():
+    # not idempotent, or speculation disabled
+    assert _run(TaskStraggler(idempotent=False), 3) > 4
+    assert _run(TaskStraggler(), None) > 4
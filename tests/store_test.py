@@ -0,0 +1,173 @@
+from pathlib import Path
+import multiprocessing
+import os
+import time
+import pytest
+import tasksflow.cache
+import tasksflow.executer
+import tasksflow.metrics
+import tasksflow.pool
+import tasksflow.store
+import tasksflow.task
+from tasksflow.executer import ExecutionError, FailureMode
+
+
+class TaskSource(tasksflow.task.Task):
+    def run(self, n: int):
+        time.sleep(0.5)
+        return {"data": bytes(n), "source_pid": os.getpid()}
+
+
+class TaskTransform(tasksflow.task.Task):
+    def run(self, data: bytes):
+        return {"transformed": data + b"\x01", "transform_pid": os.getpid()}
+
+
+class TaskSize(tasksflow.task.Task):
+    def run(self, transformed: bytes):
+        return {"size": len(transformed), "size_pid": os.getpid()}
+
+
+class TaskOther(tasksflow.task.Task):
+    def run(self, n: int):
+        return {"other": n, "other_pid": os.getpid()}
+
+
+class TaskFail(tasksflow.task.Task):
+    def run(self, transformed: bytes):
+        raise RuntimeError("task failed")
+
+
+def _square(x: int) -> int:
+    return x * x
+
+
+class TaskSubprocesses(tasksflow.task.Task):
+    def run(self, n: int):
+        with multiprocessing.get_context("spawn").Pool(2) as pool:
+            return {"squares": pool.map(_square, range(1, n + 1))}
+
+
+tasks = [TaskOther(), TaskSource(), TaskTransform(), TaskSize()]
+
+
+def _make_pool(tasks, cache_provider=None, **kwargs) -> tasksflow.pool.Pool:
+    return tasksflow.pool.Pool(
+        tasks,
+        executer=tasksflow.executer.MultiprocessExecuter(
+            cache_provider=cache_provider, max_workers=2, object_store=True, **kwargs
+        ),
+    )
+
+
+def test_object_store():
+    tasksflow.metrics.REGISTRY.clear()
+    tasksflow.metrics.enable()
+    try:
+        p = _make_pool(tasks)
+        results = p.run_many([{"n": 1024}])
+        result = next(results)[1]
+        # the pool shuts down once the generator is exhausted
+        assert next(results, None) is None
+    finally:
+        tasksflow.metrics.disable()
+
+    assert result["data"] == bytes(1024)
+    assert result["transformed"] == bytes(1024) + b"\x01"
+    assert result["size"] == 1025
+    assert result["other"] == 1024
+    # both workers are idle, the chain runs where its input is kept
+    assert result["other_pid"] != result["source_pid"]
+    assert result["source_pid"] == result["transform_pid"] == result["size_pid"]
+
+    # only the final payload is fetched
+    fetched = tasksflow.metrics.STORE_FETCHED_BYTES.value()
+    assert 2 * 1024 <= fetched < 3 * 1024
+
+
+def test_object_store_run_many():
+    p = _make_pool(tasks)
+    results = dict(p.run_many([{"n": 1}, {"n": 2}, {"n": 3}]))
+    assert {i: result["size"] for i, result in results.items()} == {0: 2, 1: 3, 2: 4}
+
+
+def test_object_store_cache():
+    db_path = Path("store_test.db")
+    db_path.unlink(missing_ok=True)
+    try:
+        for cache_provider in [
+            tasksflow.cache.MemoryCacheProvider(),
+            tasksflow.cache.SqliteCacheProvider(db_path),
+        ]:
+            p = _make_pool(tasks[1:], cache_provider)
+            first = dict(p.run_many([{"n": 16}]))[0]
+            second = dict(p.run_many([{"n": 16}]))[0]
+            # the pids are cached, so nothing is executed again
+            assert first == second
+    finally:
+        db_path.unlink(missing_ok=True)
+
+
+def test_object_store_worker_metrics():
+    """
+    metrics recorded by the workers caching results are merged into the parent registry
+    """
+    db_path = Path("store_test.db")
+    db_path.unlink(missing_ok=True)
+    tasksflow.metrics.REGISTRY.clear()
+    tasksflow.metrics.enable()
+    try:
+        p = _make_pool(tasks[1:], tasksflow.cache.SqliteCacheProvider(db_path))
+        dict(p.run_many([{"n": 16}]))
+        assert tasksflow.metrics.CACHE_WRITES.value(provider="SqliteCacheProvider") == 3
+    finally:
+        tasksflow.metrics.disable()
+        db_path.unlink(missing_ok=True)
+
+
+def test_worker_pool_free():
+    ctx = multiprocessing.get_context("spawn")
+    with tasksflow.store.WorkerPool(1, ctx) as pool:
+        ref = pool.submit(0, tasksflow.store.put, b"value").result()
+        assert pool.fetch([ref]) == [b"value"]
+        pool.free([ref])
+        with pytest.raises(KeyError):
+            pool.fetch([ref])
+
+
+def test_worker_pool_lazy():
+    ctx = multiprocessing.get_context("spawn")
+    with tasksflow.store.WorkerPool(2, ctx) as pool:
+        # workers are started on their first call
+        assert pool.workers == [None, None]
+        assert pool.submit(1, os.getpid).result() != os.getpid()
+        assert pool.workers[0] is None
+        assert pool.workers[1] is not None
+
+
+def test_worker_subprocesses():
+    """
+    workers are not daemonic, so tasks can start processes of their own
+    """
+    for object_store in [False, True]:
+        p = tasksflow.pool.Pool(
+            [TaskSubprocesses()],
+            executer=tasksflow.executer.MultiprocessExecuter(
+                max_workers=1, object_store=object_store
+            ),
+        )
+        assert dict(p.run_many([{"n": 3}]))[0]["squares"] == [1, 4, 9]
+
+
+def test_object_store_failure():
+    p = _make_pool(
+        [TaskOther(), TaskSource(), TaskTransform(), TaskFail()],
+        failure_mode=FailureMode.KEEP_GOING,
+    )
+    results = p.run_many([{"n": 8}])
+    with pytest.raises(ExecutionError) as exc_info:
+        next(results)
+    results.close()
+    payload = exc_info.value.payload
+    assert payload["transformed"] == bytes(8) + b"\x01"
+    assert payload["other"] == 8